@@ -0,0 +1,153 @@
+# batch.py - renders many pictures without a display
+# Author: Ben Plaut
+# Renders every combination of shapes, training files, train region sizes,
+# shape strengths and seeds in a sweep. Each unique palette is trained once in
+# the main process, and the trained model is handed to a pool of worker
+# processes (one per core by default) which do the generation.
+# Examples:
+#   python batch.py --shapes circle,squiggles -f gradient3.jpg -f gradient1.jpg,gradient2.jpg --seeds 0-9
+#   python batch.py --spec sweep.json
+# where sweep.json has the same keys as the command line options, e.g.
+#   {"shapes": ["circle"], "training_files": [["gradient3.jpg"]], "seeds": [0, 1]}
+# Required external modules: PIL, numpy
+# Required python files: main.py, util.py, markov.py
+
+import argparse
+import itertools
+import json
+import multiprocessing
+import os
+import time
+import main
+import markov
+import util
+
+# trained counts for each (palette files, train region size), set up in each
+# worker by init_worker, and the compiled versions as the worker needs them
+worker_trained = None
+worker_compiled = dict()
+
+def init_worker(trained):
+    global worker_trained
+    worker_trained = trained
+
+def render_job(job):
+    (shape, palette_files, train_region_size, shape_strength, seed,
+     result_size, palette_short_dir, field_cache_dir) = job
+    params = main.make_params(main.SHAPES[shape], palette_files,
+                              train_region_size, result_size, shape_strength,
+                              palette_short_dir)
+    (_, _, train_palette_size, gen_region_size, _, _, _, shape_func, _, _, _,
+     _) = params
+    model = main.Model(*params, field_cache_dir=field_cache_dir, seed=seed)
+    # every worker printing its progress would just be a jumble
+    model.show_progress = False
+    key = (tuple(palette_files), train_region_size)
+    if key not in worker_compiled:
+        worker_compiled[key] = markov.compile_counts(worker_trained[key])
+    model.set_trained(worker_trained[key], worker_compiled[key])
+    image = model.generate()
+    output_name = util.make_output_name(
+        shape_func, train_region_size, gen_region_size, train_palette_size,
+        palette_files, shape_strength, seed=seed)
+    os.makedirs(os.path.dirname(output_name), exist_ok=True)
+    image.save(output_name)
+    return output_name
+
+def train_palettes(sweep, model_cache_dir, thumbnail_cache_dir):
+    # train each unique palette once, returns the counts for each
+    trained = dict()
+    for (palette_files, train_region_size) in itertools.product(
+            sweep['training_files'], sweep['train_region_sizes']):
+        key = (tuple(palette_files), train_region_size)
+        if key in trained:
+            continue
+        params = main.make_params(main.SHAPES[sweep['shapes'][0]],
+                                  palette_files, train_region_size,
+                                  sweep['result_size'], 1,
+                                  sweep['palette_dir'])
+        model = main.Model(*params, model_cache_dir=model_cache_dir,
+                           thumbnail_cache_dir=thumbnail_cache_dir)
+        print("Training model for %s, train_region_size=%d..." %
+              (','.join(palette_files), train_region_size))
+        model.train_palette()
+        trained[key] = model.counts
+    return trained
+
+def make_jobs(sweep, field_cache_dir):
+    return [(shape, palette_files, train_region_size, shape_strength, seed,
+             sweep['result_size'], sweep['palette_dir'], field_cache_dir)
+            for (shape, palette_files, train_region_size, shape_strength, seed)
+            in itertools.product(sweep['shapes'], sweep['training_files'],
+                                 sweep['train_region_sizes'],
+                                 sweep['shape_strengths'], sweep['seeds'])]
+
+def parse_ints(s):
+    # "0-3,7" -> [0, 1, 2, 3, 7]
+    result = []
+    for part in s.split(','):
+        if '-' in part[1:]:
+            (start, end) = part.split('-', 1)
+            result += list(range(int(start), int(end) + 1))
+        else:
+            result.append(int(part))
+    return result
+
+def get_sweep():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--spec', help="JSON file with the sweep, using the same keys as these options. Overrides them", type=str, default=None)
+    parser.add_argument('--shapes', '-s', help="comma separated list of shapes, see main.py", type=str, default='circle')
+    parser.add_argument('--training_files', '-f', help="comma separated list of filenames to train one palette on. Repeat for more palettes", action='append', default=None)
+    parser.add_argument('--train_region_sizes', '-t', help="comma separated list, or ranges like 1-3", type=str, default='2')
+    parser.add_argument('--shape_strengths', '-g', help="comma separated list, or ranges like 1-3", type=str, default='100')
+    parser.add_argument('--seeds', help="comma separated list, or ranges like 0-9", type=str, default='0')
+    parser.add_argument('--result_size', '-r', help="width and height of outputs", type=int, default=500)
+    parser.add_argument('--palette_dir', help="directory containing the training files", type=str, default='input/gradients')
+    parser.add_argument('--processes', '-p', help="number of worker processes. Defaults to the number of cores", type=int, default=None)
+    parser.add_argument('--model_cache_dir', help="directory for caching trained models between runs, 'none' to disable", type=str, default='cache/models')
+    parser.add_argument('--thumbnail_cache_dir', help="directory for caching resized training images between runs, 'none' to disable", type=str, default='cache/thumbnails')
+    parser.add_argument('--field_cache_dir', help="directory for caching shape fields between runs", type=str, default=None)
+    args = parser.parse_args()
+    sweep = {'shapes': args.shapes.split(','),
+             'training_files': [files.split(',') for files in
+                                (args.training_files or ['gradient3.jpg'])],
+             'train_region_sizes': parse_ints(args.train_region_sizes),
+             'shape_strengths': parse_ints(args.shape_strengths),
+             'seeds': parse_ints(args.seeds),
+             'result_size': args.result_size,
+             'palette_dir': args.palette_dir}
+    if args.spec is not None:
+        with open(args.spec) as f:
+            sweep.update(json.load(f))
+        # palettes can be given as lists or comma separated strings
+        sweep['training_files'] = [
+            files.split(',') if isinstance(files, str) else files
+            for files in sweep['training_files']]
+    for shape in sweep['shapes']:
+        if shape not in main.SHAPES:
+            print("Unknown shape '%s', exiting" % shape)
+            exit()
+    model_cache_dir = (None if args.model_cache_dir == 'none'
+                       else args.model_cache_dir)
+    thumbnail_cache_dir = (None if args.thumbnail_cache_dir == 'none'
+                           else args.thumbnail_cache_dir)
+    return (sweep, args.processes or os.cpu_count(), model_cache_dir,
+            thumbnail_cache_dir, args.field_cache_dir)
+
+def run_batch():
+    (sweep, processes, model_cache_dir, thumbnail_cache_dir,
+     field_cache_dir) = get_sweep()
+    trained = train_palettes(sweep, model_cache_dir, thumbnail_cache_dir)
+    jobs = make_jobs(sweep, field_cache_dir)
+    print("Rendering %d images with %d processes..." % (len(jobs), processes))
+    start = time.time()
+    with multiprocessing.Pool(processes, initializer=init_worker,
+                              initargs=(trained,)) as pool:
+        for output_name in pool.imap_unordered(render_job, jobs):
+            print("Saved %s" % output_name)
+    elapsed = time.time() - start
+    print("Rendered %d images in %.1fs (%.2f images/s)" %
+          (len(jobs), elapsed, len(jobs) / elapsed))
+
+if __name__ == "__main__":
+    run_batch()
@@ -0,0 +1,224 @@
+# benchmark.py - timing benchmarks for startup, training and generation
+# Author: Ben Plaut
+# Times starting up (importing main in a fresh interpreter),
+# Model.train_palette, sampling one pixel's color (with both color models),
+# the floodfill neighbor shuffle, and full Model.generate runs for several
+# shapes and output sizes, on the bundled gradients and fractals palettes.
+# Everything is seeded, so runs are comparable. Results are written to a JSON
+# file and compared against a stored baseline to catch regressions. The
+# baseline in the repo (benchmark_baseline.json) is a default run on one
+# machine, so its meta section says what it was run on; timings from other
+# machines should be compared against a baseline made there with
+# --save_baseline. Startup also has a fixed budget, and must not load any
+# GUI modules.
+# Examples:
+#   python benchmark.py                      # quick run, compare to baseline
+#   python benchmark.py --full               # output sizes up to 4000
+#   python benchmark.py --save_baseline      # make this run the new baseline
+# Required external modules: PIL, numpy
+# Required python files: main.py, util.py, markov.py, joint.py
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import numpy as np
+import main
+import markov
+import joint
+import util
+
+SEED = 0
+PALETTES = {'gradients': ('input/gradients', ['gradient3.jpg']),
+            'fractals': ('input/fractals', ['fractal1.jpg'])}
+SHAPES = ['circle', 'squiggles', 'cosine', 'outward', 'fractal']
+QUICK_SIZES = [250, 500]
+FULL_SIZES = [250, 500, 1000, 2000, 4000]
+# how long a fresh 'import main' may take, and what it must not import
+STARTUP_BUDGET_SECONDS = 0.5
+GUI_MODULES = ['matplotlib', 'tkinter', 'PIL.ImageTk']
+
+def best_time(f, repeats, model = None):
+    # best of several runs, which is the least noisy estimate. model's
+    # random seed is reset before each run, so they all do the same work.
+    best = None
+    for _ in range(repeats):
+        if model is not None:
+            model.set_seed(SEED)
+        start = time.perf_counter()
+        f()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+def make_model(palette, shape, size, train_region_size = 2,
+               shape_strength = 100):
+    (palette_dir, palette_files) = PALETTES[palette]
+    params = main.make_params(main.SHAPES[shape], palette_files,
+                              train_region_size, size, shape_strength,
+                              palette_dir)
+    # no model cache, we want to time training
+    model = main.Model(*params, seed=SEED)
+    model.show_progress = False
+    return model
+
+def bench_startup(results, repeats):
+    # Every CLI run and worker process pays this, so it's timed from
+    # outside, interpreter startup included
+    script = ("import sys, main; print(','.join(name for name in %r "
+              "if name in sys.modules))" % GUI_MODULES)
+    command = [sys.executable, '-c', script]
+    cwd = os.path.dirname(os.path.abspath(__file__))
+    best = None
+    for _ in range(repeats):
+        start = time.perf_counter()
+        output = subprocess.check_output(command, cwd=cwd)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    gui_modules = [name for name in output.decode().strip().split(',') if name]
+    results['startup/import_main'] = {'seconds': best,
+                                      'gui_modules': gui_modules}
+    print("startup: %.3fs" % best)
+
+def check_startup(results):
+    # returns a list of the ways startup went over its budget
+    startup = results['startup/import_main']
+    problems = []
+    if startup['seconds'] > STARTUP_BUDGET_SECONDS:
+        problems.append("import main took %.3fs, the budget is %.3fs" %
+                        (startup['seconds'], STARTUP_BUDGET_SECONDS))
+    if startup['gui_modules']:
+        problems.append("import main loaded %s" %
+                        ', '.join(startup['gui_modules']))
+    return problems
+
+def bench_training(results, repeats):
+    for palette in PALETTES:
+        model = make_model(palette, 'circle', 100)
+        results['train/%s' % palette] = {
+            'seconds': best_time(model.train_palette, repeats)}
+
+def bench_sampling(results, repeats, num_samples = 10**5):
+    model = make_model('gradients', 'circle', 100)
+    model.train_palette()
+    prev_vals = np.random.default_rng(SEED).integers(
+        0, markov.NUM_VALS, size=(num_samples, 3)).tolist()
+    def sample_all():
+        (red_table, green_table, blue_table) = model.tables
+        rand = model.rng.random
+        for (r, g, b) in prev_vals:
+            markov.sample_row(red_table[r], rand())
+            markov.sample_row(green_table[g], rand())
+            markov.sample_row(blue_table[b], rand())
+    seconds = best_time(sample_all, repeats, model)
+    results['sample/one_neighbor'] = {'seconds': seconds,
+                                      'ns_per_sample': 1e9 * seconds / num_samples}
+    joint_model = make_model('gradients', 'circle', 100)
+    joint_model.color_model = 'joint'
+    joint_model.train_palette()
+    def sample_all_joint():
+        nearest_code = joint_model.nearest_code
+        code_table = joint_model.code_table
+        rand = joint_model.rng.random
+        for (r, g, b) in prev_vals:
+            code = nearest_code[joint.lut_index(r, g, b)]
+            markov.sample_row(code_table[code], rand())
+    seconds = best_time(sample_all_joint, repeats, joint_model)
+    results['sample/one_neighbor_joint'] = {
+        'seconds': seconds, 'ns_per_sample': 1e9 * seconds / num_samples}
+    points = [(1, 0), (0, 1), (0, -1), (-1, 0)]
+    wts = [100.0, 1.0, 37.0, 1.0]
+    def shuffle_all():
+        rand = model.rng.random
+        for _ in range(num_samples):
+            util.weighted_random_shuffle4(points, wts, rand)
+    seconds = best_time(shuffle_all, repeats, model)
+    results['sample/neighbor_shuffle'] = {'seconds': seconds,
+                                          'ns_per_sample': 1e9 * seconds / num_samples}
+
+def bench_generation(results, sizes, repeats):
+    for palette in PALETTES:
+        for shape in SHAPES:
+            for size in sizes:
+                model = make_model(palette, shape, size)
+                model.train_palette()
+                # big sizes take a long time, so only run them once
+                seconds = best_time(model.generate,
+                                    repeats if size <= 500 else 1, model)
+                results['generate/%s/%s/%d' % (palette, shape, size)] = {
+                    'seconds': seconds,
+                    'pixels_per_second': size * size / seconds}
+                print("generate %s %s %d: %.2fs" % (palette, shape, size,
+                                                     seconds))
+
+def compare(results, baseline, threshold):
+    # returns the names of the benchmarks that got more than threshold slower
+    regressions = []
+    for (name, result) in sorted(results.items()):
+        if name not in baseline:
+            continue
+        ratio = result['seconds'] / baseline[name]['seconds']
+        flag = ''
+        if ratio > 1 + threshold:
+            regressions.append(name)
+            flag = '  <-- REGRESSION'
+        print("%-40s %8.3fs  baseline %8.3fs  %5.2fx%s" %
+              (name, result['seconds'], baseline[name]['seconds'], ratio,
+               flag))
+    return regressions
+
+def main_benchmark():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--full', help="run output sizes up to 4000, which takes a long time", action='store_true', default=False)
+    parser.add_argument('--sizes', help="comma separated output sizes, overrides --full", type=str, default=None)
+    parser.add_argument('--repeats', help="take the best of this many runs", type=int, default=3)
+    parser.add_argument('--output', '-o', help="where to write the results", type=str, default='benchmark_results.json')
+    parser.add_argument('--baseline', '-b', help="results to compare against", type=str, default='benchmark_baseline.json')
+    parser.add_argument('--save_baseline', help="also write the results as the new baseline", action='store_true', default=False)
+    parser.add_argument('--threshold', help="fraction slower than the baseline that counts as a regression", type=float, default=0.2)
+    args = parser.parse_args()
+    if args.sizes is not None:
+        sizes = [int(size) for size in args.sizes.split(',')]
+    else:
+        sizes = FULL_SIZES if args.full else QUICK_SIZES
+
+    results = dict()
+    bench_startup(results, args.repeats)
+    bench_training(results, args.repeats)
+    bench_sampling(results, args.repeats)
+    bench_generation(results, sizes, args.repeats)
+    output = {'meta': {'python': platform.python_version(),
+                       'numpy': np.__version__,
+                       'machine': platform.machine(),
+                       'processor': platform.processor(),
+                       'time': time.strftime('%Y-%m-%d %H:%M:%S')},
+              'results': results}
+    with open(args.output, 'w') as f:
+        json.dump(output, f, indent=2, sort_keys=True)
+    print("Wrote results to %s" % args.output)
+    startup_problems = check_startup(results)
+    for problem in startup_problems:
+        print("Startup over budget: %s" % problem)
+    if args.save_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump(output, f, indent=2, sort_keys=True)
+        print("Wrote baseline to %s" % args.baseline)
+    elif os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)['results']
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print("%d benchmark(s) regressed by more than %d%%" %
+                  (len(regressions), 100 * args.threshold))
+            sys.exit(1)
+    else:
+        print("No baseline at %s, run with --save_baseline to make one" %
+              args.baseline)
+    if startup_problems:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main_benchmark()
@@ -0,0 +1,72 @@
+# buffered_random.py - the random number generator for main.py
+# Author: Ben Plaut
+# Contains BufferedRandom, a seedable random number generator that draws
+# uniform floats from numpy in big batches and hands them out one at a time.
+# Every random choice in generation goes through one of these (threaded
+# through the Model), so a run is reproducible from its seed, and the
+# per-draw cost in the pixel loops is about that of random.random.
+# Required external modules: numpy
+# Required python files: None
+
+import itertools
+import operator
+import numpy as np
+
+class BufferedRandom(object):
+    def __init__(self, seed = None, buffer_size = 2**16):
+        self.generator = np.random.default_rng(seed)
+        self.buffer_size = buffer_size
+        self.start_stream()
+
+    def buffers(self):
+        # Endless iterators over fresh buffers of uniforms. We remember the
+        # generator state each buffer came from and keep a handle on its
+        # iterator, so getstate can tell exactly how far into it we are.
+        while True:
+            self.buffer_state = self.generator.bit_generator.state
+            self.current = iter(self.generator.random(self.buffer_size).tolist())
+            self.current_size = self.buffer_size
+            yield self.current
+
+    def start_stream(self, skip = 0):
+        # Until the first draw there's no buffer, so the state is just the
+        # generator's, with nothing consumed. getstate and pickling need
+        # this on a fresh generator too.
+        self.buffer_state = self.generator.bit_generator.state
+        self.current = iter([])
+        self.current_size = 0
+        stream = itertools.chain.from_iterable(self.buffers())
+        # random() is next() on the stream, which is all in C
+        self.random = stream.__next__
+        for _ in range(skip):
+            self.random()
+
+    def choice(self, seq):
+        return seq[int(self.random() * len(seq))]
+
+    def randrange(self, n):
+        return int(self.random() * n)
+
+    def seed_int(self):
+        # a seed for another generator (e.g. numpy's or a worker's), taken
+        # from our own stream so our state stays easy to save
+        return int(self.random() * 2**53)
+
+    def getstate(self):
+        consumed = self.current_size - operator.length_hint(self.current)
+        return (self.buffer_state, consumed)
+
+    def setstate(self, state):
+        (buffer_state, consumed) = state
+        self.generator.bit_generator.state = buffer_state
+        self.start_stream(skip=consumed)
+
+    def __getstate__(self):
+        # the stream is a generator, which can't be pickled, so send models
+        # to other processes with just the state needed to rebuild it
+        return (self.buffer_size, self.getstate())
+
+    def __setstate__(self, pickled):
+        (self.buffer_size, state) = pickled
+        self.generator = np.random.default_rng()
+        self.setstate(state)
@@ -0,0 +1,144 @@
+# cache.py - on-disk caches for main.py
+# Author: Ben Plaut
+# Contains helper functions for keeping things we've already computed (trained
+# models, shape fields, resized training images) on disk between runs. Cache
+# files are named by a hash of everything that went into them, and old files
+# are evicted so the cache directories stay bounded.
+# Required external modules: numpy
+# Required python files: None
+
+import hashlib
+import os
+import time
+import numpy as np
+
+# default limits for each cache directory
+MAX_CACHE_BYTES = 2**30
+MAX_CACHE_AGE_DAYS = 30
+
+def hash_file(path):
+    hasher = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(2**20), b''):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+def hash_key(*parts):
+    # parts can be anything with a stable repr (strings, numbers, tuples)
+    return hashlib.sha256(repr(parts).encode('utf-8')).hexdigest()[:32]
+
+def model_key(palette_paths, train_region_size, train_palette_size, offsets):
+    # The trained model only depends on the palette contents (not their
+    # names or locations) and the training parameters
+    file_hashes = tuple(hash_file(path) for path in palette_paths)
+    return hash_key('model', file_hashes, train_region_size,
+                    train_palette_size, tuple(offsets))
+
+def model_path(cache_dir, key):
+    return os.path.join(cache_dir, 'model_%s.npz' % key)
+
+def joint_model_path(cache_dir, key):
+    return os.path.join(cache_dir, 'joint_%s.npz' % key)
+
+def thumbnail_key(file_hash, train_palette_size):
+    # a training image resized to train_palette_size only depends on the
+    # image contents
+    return hash_key('thumbnail', file_hash, train_palette_size)
+
+def thumbnail_path(cache_dir, key):
+    return os.path.join(cache_dir, 'thumbnail_%s.npy' % key)
+
+def touch(path):
+    # mark as recently used, so eviction removes it last
+    os.utime(path, None)
+
+def load_model(cache_dir, key):
+    # returns the cached transition counts, or None if we don't have them
+    path = model_path(cache_dir, key)
+    if not os.path.exists(path):
+        return None
+    try:
+        with np.load(path) as data:
+            counts = data['counts'].astype(np.uint32)
+    except (OSError, ValueError, KeyError): # corrupt or partially written
+        return None
+    touch(path)
+    return counts
+
+def save_model(cache_dir, key, counts):
+    os.makedirs(cache_dir, exist_ok=True)
+    path = model_path(cache_dir, key)
+    # most counts are 0, so this compresses very well. Write to a temp file
+    # first so other processes never see a half written model.
+    tmp_path = path + '.%d.tmp' % os.getpid()
+    with open(tmp_path, 'wb') as f:
+        np.savez_compressed(f, counts=counts)
+    os.replace(tmp_path, path)
+    evict(cache_dir)
+
+def load_joint_model(cache_dir, key):
+    # returns the cached (codebook, counts) of a joint.py model, or None
+    path = joint_model_path(cache_dir, key)
+    if not os.path.exists(path):
+        return None
+    try:
+        with np.load(path) as data:
+            model = (data['codebook'], data['counts'].astype(np.int64))
+    except (OSError, ValueError, KeyError): # corrupt or partially written
+        return None
+    touch(path)
+    return model
+
+def save_joint_model(cache_dir, key, codebook, counts):
+    # same as save_model
+    os.makedirs(cache_dir, exist_ok=True)
+    path = joint_model_path(cache_dir, key)
+    tmp_path = path + '.%d.tmp' % os.getpid()
+    with open(tmp_path, 'wb') as f:
+        np.savez_compressed(f, codebook=codebook, counts=counts)
+    os.replace(tmp_path, path)
+    evict(cache_dir)
+
+def load_thumbnail(cache_dir, key):
+    # returns the cached (height, width, 3) pixels, or None
+    path = thumbnail_path(cache_dir, key)
+    if not os.path.exists(path):
+        return None
+    try:
+        pixels = np.load(path)
+    except (OSError, ValueError): # corrupt or partially written
+        return None
+    touch(path)
+    return pixels
+
+def save_thumbnail(cache_dir, key, pixels):
+    # No eviction here, since there can be thousands of these per training
+    # run; the caller evicts once at the end
+    os.makedirs(cache_dir, exist_ok=True)
+    path = thumbnail_path(cache_dir, key)
+    tmp_path = path + '.%d.tmp' % os.getpid()
+    with open(tmp_path, 'wb') as f:
+        np.save(f, pixels)
+    os.replace(tmp_path, path)
+
+def evict(cache_dir, max_bytes = MAX_CACHE_BYTES,
+          max_age_days = MAX_CACHE_AGE_DAYS):
+    # Removes files that haven't been used in max_age_days, then the least
+    # recently used files until the directory is at most max_bytes
+    entries = []
+    for name in os.listdir(cache_dir):
+        path = os.path.join(cache_dir, name)
+        if os.path.isfile(path):
+            stat = os.stat(path)
+            entries.append((stat.st_mtime, stat.st_size, path))
+    entries.sort() # oldest first
+    oldest_allowed = time.time() - max_age_days * 24 * 60 * 60
+    total_bytes = sum(size for (_, size, _) in entries)
+    for (mtime, size, path) in entries:
+        if mtime >= oldest_allowed and total_bytes <= max_bytes:
+            break
+        try:
+            os.remove(path)
+        except OSError: # someone else already removed it
+            pass
+        total_bytes -= size
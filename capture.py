@@ -0,0 +1,133 @@
+# capture.py - recording and encoding time-lapses of generation
+# Author: Ben Plaut
+# While generating, Model only remembers the order in which pixels were
+# filled (see Model.start_capture). Every pixel is filled exactly once, so
+# its color at the end is the color it was filled with, and save() stores
+# the order (as runs of consecutive pixels) plus the colors in that order.
+# Each frame of the time-lapse is then the previous frame plus the next
+# frame_every pixels, which is all the encoder needs.
+# Examples:
+#   python main.py -r 500 --capture run.npz --no_display
+#   python capture.py run.npz run.gif
+#   python capture.py run.npz run.png --every 5000   # animated PNG
+#   python capture.py run.npz frames/                # one PNG per frame
+# Required external modules: PIL, numpy
+# Required python files: None
+
+import argparse
+import itertools
+import os
+import numpy as np
+from PIL import Image
+
+def to_runs(order):
+    # [5, 6, 7, 2, 3] -> starts [5, 2], lengths [3, 2]
+    breaks = np.flatnonzero(np.diff(order.astype(np.int64)) != 1) + 1
+    starts = order[np.concatenate([[0], breaks])] if len(order) else order
+    lengths = np.diff(np.concatenate([[0], breaks, [len(order)]]))
+    return (starts, lengths)
+
+def from_runs(starts, lengths):
+    run_offsets = np.cumsum(lengths) - lengths # where each run begins
+    return (np.repeat(starts.astype(np.int64) - run_offsets, lengths)
+            + np.arange(lengths.sum()))
+
+def save(path, order, result_array, frame_every):
+    # order is the flat indices (y * width + x) of the generated pixels, in
+    # the order they were generated, and result_array the finished picture
+    (height, width, _) = result_array.shape
+    order = np.asarray(order, dtype=np.uint32)
+    (starts, lengths) = to_runs(order)
+    colors = result_array.reshape(-1, 3)[order]
+    # write to a temp file first, like checkpoint.save
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        np.savez_compressed(f, starts=starts, lengths=lengths, colors=colors,
+                            width=width, height=height,
+                            frame_every=frame_every)
+    os.replace(tmp_path, path)
+
+def load(path):
+    # returns (order, colors, width, height, frame_every)
+    with np.load(path) as data:
+        order = from_runs(data['starts'], data['lengths'])
+        return (order, data['colors'], int(data['width']),
+                int(data['height']), int(data['frame_every']))
+
+def frames(path, frame_every = None, max_size = None):
+    # Yields the frames as Images, each with frame_every more pixels than
+    # the last (default: what the capture was recorded with), ending with
+    # the finished picture. max_size shrinks frames to fit in that size.
+    (order, colors, width, height, default_every) = load(path)
+    frame_every = frame_every or default_every
+    canvas = np.zeros((height * width, 3), dtype=np.uint8)
+    for start in range(0, len(order), frame_every):
+        canvas[order[start:start + frame_every]] = colors[start:start +
+                                                          frame_every]
+        image = Image.fromarray(canvas.reshape(height, width, 3).copy())
+        if max_size is not None and max(width, height) > max_size:
+            image.thumbnail((max_size, max_size))
+        yield image
+
+class FrameSequence(object):
+    # The frames from frames() after the first skip of them, decoded again
+    # every time this is iterated over, so the decoded frames are never all
+    # in memory at once. Pillow goes over the frames of an animated PNG
+    # twice (first to check their modes and sizes), so a plain generator
+    # wouldn't do. num_frames is how many the last pass went through.
+    def __init__(self, capture_path, frame_every = None, max_size = None,
+                 skip = 0):
+        self.capture_path = capture_path
+        self.frame_every = frame_every
+        self.max_size = max_size
+        self.skip = skip
+        self.num_frames = 0
+
+    def __iter__(self):
+        self.num_frames = 0
+        for image in itertools.islice(frames(self.capture_path,
+                                             self.frame_every, self.max_size),
+                                      self.skip, None):
+            self.num_frames += 1
+            yield image
+
+def encode(capture_path, output_path, frame_every = None, max_size = None,
+           frame_ms = 40):
+    # Writes an animated GIF or PNG, or if output_path is a directory (ends
+    # with a slash or already exists), one numbered PNG per frame
+    if output_path.endswith(os.sep) or os.path.isdir(output_path):
+        os.makedirs(output_path, exist_ok=True)
+        num_frames = 0
+        for (i, image) in enumerate(frames(capture_path, frame_every,
+                                           max_size)):
+            image.save(os.path.join(output_path, 'frame_%06d.png' % i))
+            num_frames += 1
+        return num_frames
+    # Pillow takes the rest of the frames as any iterable and reads them as
+    # it writes. It still keeps its own copy of each frame it has written
+    # (palettized for GIFs) to diff the next one against, so very long
+    # captures are better off as a directory of frames.
+    first = next(frames(capture_path, frame_every, max_size))
+    rest = FrameSequence(capture_path, frame_every, max_size, skip=1)
+    first.save(output_path, save_all=True, append_images=rest,
+               duration=frame_ms, loop=0)
+    return 1 + rest.num_frames
+
+def main_capture():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('capture', help="capture file from main.py --capture", type=str)
+    parser.add_argument('output', help="animated .gif or .png, or a directory for one PNG per frame", type=str)
+    parser.add_argument('--every', help="pixels per frame. Defaults to the --capture_every the capture was made with", type=int, default=None)
+    parser.add_argument('--max_size', help="shrink frames to at most this width and height. Defaults to 500 for animations and full size for frame directories", type=int, default=None)
+    parser.add_argument('--frame_ms', help="how long each frame of an animation is shown", type=int, default=40)
+    args = parser.parse_args()
+    max_size = args.max_size
+    is_dir = args.output.endswith(os.sep) or os.path.isdir(args.output)
+    if max_size is None and not is_dir:
+        max_size = 500
+    num_frames = encode(args.capture, args.output, args.every, max_size,
+                        args.frame_ms)
+    print("Wrote %d frames to %s" % (num_frames, args.output))
+
+if __name__ == "__main__":
+    main_capture()
@@ -0,0 +1,131 @@
+# check_shuffle.py - statistical check of util.weighted_random_shuffle4
+# Author: Ben Plaut
+# weighted_random_shuffle4 is supposed to give exactly the same distribution
+# over the 24 orders of the 4 floodfill directions as weighted_random_shuffle.
+# For several wt vectors this draws many orders from each, and runs chi-square
+# tests of both against the exact probability of every order, and of the two
+# against each other. Everything is seeded, so a run is repeatable. Exits
+# with status 1 if any test fails.
+# Examples:
+#   python check_shuffle.py
+#   python check_shuffle.py --draws 1000000 --seed 3
+# Required external modules: None
+# Required python files: util.py
+
+import argparse
+import itertools
+import math
+import random
+import sys
+import util
+
+POINTS = [(1, 0), (0, 1), (0, -1), (-1, 0)]
+# equal, typical shape field, very lopsided, and one near zero
+WTS = [[1.0, 1.0, 1.0, 1.0],
+       [100.0, 1.0, 37.0, 1.0],
+       [1.0, 2.0, 3.0, 4.0],
+       [1000.0, 1.0, 1.0, 1.0],
+       [5.0, 1e-3, 5.0, 2.0]]
+Z_ALPHA = 3.090 # one sided normal quantile for a 0.1% false alarm rate
+# orders expected less often than this are pooled into one cell, since the
+# chi-square approximation doesn't hold for tiny counts
+MIN_EXPECTED = 5
+
+def exact_probs(wts):
+    # the probability of each order of POINTS: each step picks one of the
+    # remaining points with probability proportional to its wt
+    probs = dict()
+    for order in itertools.permutations(range(4)):
+        prob = 1.0
+        remaining = sum(wts)
+        for i in order:
+            prob *= wts[i] / remaining
+            remaining -= wts[i]
+        probs[tuple(POINTS[i] for i in order)] = prob
+    return probs
+
+def chi_square_critical(df, z = Z_ALPHA):
+    # Wilson-Hilferty approximation of the chi-square quantile, which is
+    # plenty accurate for the 23 or so degrees of freedom we have
+    a = 2.0 / (9 * df)
+    return df * (1 - a + z * math.sqrt(a))**3
+
+def pooled_cells(probs, num_draws):
+    # groups of orders to test together: one per order, except the rare
+    # ones, which all go in one group (if it's big enough to test)
+    common = [[order] for (order, prob) in probs.items()
+              if num_draws * prob >= MIN_EXPECTED]
+    rare = [order for (order, prob) in probs.items()
+            if num_draws * prob < MIN_EXPECTED]
+    if num_draws * sum(probs[order] for order in rare) >= MIN_EXPECTED:
+        common.append(rare)
+    return common
+
+def goodness_of_fit(counts, probs, num_draws):
+    # (statistic, degrees of freedom) against the exact probabilities
+    cells = pooled_cells(probs, num_draws)
+    stat = 0.0
+    for cell in cells:
+        expected = num_draws * sum(probs[order] for order in cell)
+        observed = sum(counts.get(order, 0) for order in cell)
+        stat += (observed - expected)**2 / expected
+    return (stat, len(cells) - 1)
+
+def homogeneity(counts_a, counts_b, probs, num_draws):
+    # (statistic, degrees of freedom) for whether two samples of num_draws
+    # come from the same distribution, with the same cells as above
+    cells = pooled_cells(probs, num_draws)
+    stat = 0.0
+    for cell in cells:
+        count_a = sum(counts_a.get(order, 0) for order in cell)
+        count_b = sum(counts_b.get(order, 0) for order in cell)
+        if count_a + count_b > 0:
+            stat += (count_a - count_b)**2 / float(count_a + count_b)
+    return (stat, len(cells) - 1)
+
+def sample_counts(shuffle, num_draws):
+    counts = dict()
+    for _ in range(num_draws):
+        order = tuple(shuffle())
+        counts[order] = counts.get(order, 0) + 1
+    return counts
+
+def check(wts, num_draws):
+    # returns a list of (test name, statistic, critical value) that failed
+    probs = exact_probs(wts)
+    counts4 = sample_counts(
+        lambda: util.weighted_random_shuffle4(POINTS, wts), num_draws)
+    counts = sample_counts(
+        lambda: util.weighted_random_shuffle(POINTS, wts), num_draws)
+    failures = []
+    for (name, (stat, df)) in [('shuffle4 vs exact',
+                                goodness_of_fit(counts4, probs, num_draws)),
+                               ('shuffle vs exact',
+                                goodness_of_fit(counts, probs, num_draws)),
+                               ('shuffle4 vs shuffle',
+                                homogeneity(counts4, counts, probs,
+                                            num_draws))]:
+        critical = chi_square_critical(df)
+        ok = stat <= critical
+        print("wts %-28s %-20s chi2 %7.2f  df %2d  critical %6.2f  %s" %
+              (wts, name, stat, df, critical, 'ok' if ok else 'FAIL'))
+        if not ok:
+            failures.append((name, stat, critical))
+    return failures
+
+def main_check():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--draws', help="orders to draw from each shuffle for each wt vector", type=int, default=200000)
+    parser.add_argument('--seed', help="random seed", type=int, default=0)
+    args = parser.parse_args()
+    random.seed(args.seed)
+    failures = []
+    for wts in WTS:
+        failures += check(wts, args.draws)
+    if failures:
+        print("%d tests failed" % len(failures))
+        sys.exit(1)
+    print("All tests passed")
+
+if __name__ == "__main__":
+    main_check()
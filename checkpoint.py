@@ -0,0 +1,38 @@
+# checkpoint.py - saving and loading generation state for main.py
+# Author: Ben Plaut
+# Contains helper functions for writing the state of a generation run to disk
+# and reading it back, so a long run that gets interrupted can be resumed
+# from where it left off. Model.checkpoint_state and Model.restore_state
+# decide what goes in the state; this file just stores it.
+# Required external modules: numpy
+# Required python files: None
+
+import os
+import pickle
+import numpy as np
+
+def save(path, state, preview_image = None):
+    # state is a dict of numpy arrays and small picklable python values.
+    # Arrays are stored as is, everything else is pickled into one array.
+    arrays = {name: val for (name, val) in state.items()
+              if isinstance(val, np.ndarray)}
+    others = {name: val for (name, val) in state.items()
+              if not isinstance(val, np.ndarray)}
+    arrays['_others'] = np.frombuffer(pickle.dumps(others), dtype=np.uint8)
+    # write to a temp file first, so an interruption while saving never
+    # clobbers the previous checkpoint
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        np.savez_compressed(f, **arrays)
+    os.replace(tmp_path, path)
+    if preview_image is not None:
+        preview_image.save(preview_path(path))
+
+def load(path):
+    with np.load(path) as data:
+        state = {name: data[name] for name in data.files if name != '_others'}
+        state.update(pickle.loads(data['_others'].tobytes()))
+    return state
+
+def preview_path(path):
+    return os.path.splitext(path)[0] + '_preview.png'
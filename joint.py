@@ -0,0 +1,118 @@
+# joint.py - joint color model for main.py
+# Author: Ben Plaut
+# An alternative to the per channel model in markov.py, which samples the r,
+# g and b of a new color independently and so can make colors that were
+# never in the palette. Here the training pixels are first quantized into a
+# codebook of at most num_codes colors (median cut over all of them), and we
+# count transitions between codes instead of channel values. Generating from
+# a neighbor is then one draw from its code's row, which gives a whole
+# palette color. Finding a neighbor's code goes through a table of the
+# nearest code for every color with the low bits dropped, worked out once
+# when the model is compiled. The model is num_codes x num_codes counts plus
+# the codebook, no matter how much training data there is.
+# Required external modules: PIL, numpy
+# Required python files: markov.py, training.py, cache.py
+
+import numpy as np
+from PIL import Image
+import markov
+import training
+import cache
+
+NUM_CODES = 256 # default codebook size, and the most median cut can do
+# Bits of each channel the nearest code table goes by, so it has
+# 2**(3 * LUT_BITS) entries
+LUT_BITS = 5
+LUT_SHIFT = 8 - LUT_BITS
+# building the codebook from more pixels than this is slow and doesn't
+# change it much, so we take evenly spaced ones
+MAX_CODEBOOK_PIXELS = 2**20
+
+def lut_index(r, g, b):
+    # where (r, g, b) is in the nearest code table. Works on ints or on
+    # arrays of ints.
+    return (((r >> LUT_SHIFT) << (2 * LUT_BITS)) | ((g >> LUT_SHIFT) << LUT_BITS)
+            | (b >> LUT_SHIFT))
+
+def build_codebook(pixel_arrays, num_codes = NUM_CODES):
+    # pixel_arrays are (height, width, 3) uint8 arrays. Returns the
+    # (at most num_codes, 3) uint8 codebook.
+    pixels = np.concatenate([pixels.reshape(-1, 3) for pixels in pixel_arrays])
+    if len(pixels) > MAX_CODEBOOK_PIXELS:
+        pixels = pixels[np.linspace(0, len(pixels) - 1,
+                                    MAX_CODEBOOK_PIXELS).astype(np.intp)]
+    quantized = Image.fromarray(pixels[np.newaxis]).quantize(
+        colors=num_codes, method=Image.Quantize.MEDIANCUT)
+    palette = np.array(quantized.getpalette(), dtype=np.uint8).reshape(-1, 3)
+    # the palette is padded, so only keep the codes that are used
+    return palette[np.unique(np.asarray(quantized))]
+
+def nearest_code_table(codebook):
+    # for every entry of the table, the code closest to the middle of the
+    # colors that map to it
+    cells = np.arange(2**(3 * LUT_BITS))
+    mask = 2**LUT_BITS - 1
+    centers = np.stack([(cells >> (2 * LUT_BITS)) & mask,
+                        (cells >> LUT_BITS) & mask, cells & mask], axis=1)
+    centers = (centers << LUT_SHIFT) + (2**LUT_SHIFT // 2)
+    # |center - code|^2 = |center|^2 - 2 center.code + |code|^2, and the
+    # first term is the same for every code, so it's one matrix product
+    codes = codebook.astype(np.float64)
+    dists = (codes * codes).sum(axis=1) - 2 * np.dot(centers, codes.T)
+    return dists.argmin(axis=1).astype(np.uint8)
+
+def quantize(pixels, nearest_code):
+    # the (height, width) codes of (height, width, 3) uint8 pixels
+    pixels = pixels.astype(np.intp)
+    return nearest_code[lut_index(pixels[..., 0], pixels[..., 1],
+                                  pixels[..., 2])]
+
+def new_counts(num_codes):
+    return np.zeros((num_codes, num_codes), dtype=np.int64)
+
+def count_transitions(codes, offsets, counts):
+    # Same as markov.count_transitions, for an image of codes
+    num_codes = len(counts)
+    for (src, dst) in markov.offset_pairs(codes, offsets):
+        pairs = src.astype(np.intp) * num_codes + dst
+        counts += np.bincount(pairs.ravel(),
+                              minlength=num_codes * num_codes).reshape(
+                                  num_codes, num_codes)
+    return counts
+
+def train(image_paths, train_palette_size, offsets, num_codes = NUM_CODES,
+          thumbnail_cache_dir = None):
+    # Returns (codebook, counts). The codebook needs every training image
+    # before we can count anything, so the resized images are kept for the
+    # second pass.
+    pixel_arrays = [training.load_pixels(image_path, train_palette_size,
+                                         thumbnail_cache_dir)
+                    for image_path in image_paths]
+    codebook = build_codebook(pixel_arrays, num_codes)
+    nearest_code = nearest_code_table(codebook)
+    counts = new_counts(len(codebook))
+    for pixels in pixel_arrays:
+        count_transitions(quantize(pixels, nearest_code), offsets, counts)
+    if thumbnail_cache_dir is not None:
+        cache.evict(thumbnail_cache_dir)
+    return (codebook, counts)
+
+def compile_counts(counts, codebook):
+    # Returns (trained_codes, table, nearest_code), where table[code] is the
+    # markov.alias_table to sample the next code from. Like
+    # markov.compile_channel, codes we never saw a transition from share the
+    # row of the closest code (by color) that we did.
+    trained_codes = [code for code in range(len(counts)) if counts[code].any()]
+    row_tables = dict()
+    for code in trained_codes:
+        row = counts[code]
+        next_codes = np.flatnonzero(row).tolist()
+        row_tables[code] = markov.alias_table(next_codes,
+                                              row[next_codes].tolist())
+    colors = codebook.astype(np.int32)
+    trained_colors = colors[trained_codes]
+    table = []
+    for color in colors:
+        dists = ((trained_colors - color)**2).sum(axis=1)
+        table.append(row_tables[trained_codes[int(dists.argmin())]])
+    return (trained_codes, table, nearest_code_table(codebook))
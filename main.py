@@ -2,20 +2,49 @@
 # Author: Ben Plaut
 # Main file. Contains main model for training and generation, as well as all
 # of the parameters, which are set in the set_parameters function.
-# Required external modules: PIL
-# Requires python files: util.py
+# Required external modules: PIL, numpy
+# Requires python files: util.py, shape_funcs.py, markov.py, cache.py,
+# tiling.py, checkpoint.py, profiling.py, wavefront.py, buffered_random.py,
+# training.py, pyramid.py, capture.py, joint.py, random_permutation.py
 
-from tkinter import *
-from PIL import Image, ImageTk
+from PIL import Image
 import os
 import sys
-import random
+import copy
+import array
+import numpy as np
 import util # file with helper functions
+import markov # the color transition model
+import joint # the joint color alternative to markov
+import cache # for reusing trained models between runs
+import training # for training on many images on several cores
+import tiling # for generating big pictures on several cores
+import checkpoint # for saving and resuming long runs
+import capture # for time-lapses of generation
+import profiling # optional timing of each phase
+import wavefront # batched alternative to the depth first floodfill
+import pyramid # coarse to fine alternative for very big pictures
 import shape_funcs # for weighting directions in floodfill
+from buffered_random import BufferedRandom # all of our random choices
+from random_permutation import RandomPermutation # for picking seeds
 import argparse
 
+# Each frame of the floodfill's stack is one int: the pixel's flat index,
+# then the order to try its 4 neighbors in (which step_offsets, 2 bits
+# each), then how many of them we've tried so far. That's 8 bytes a frame,
+# and the stack can get to most of the canvas.
+TRIED_BITS = 3
+ORDER_BITS = 8
+TRIED_MASK = 2**TRIED_BITS - 1
+
 class Model(object):
-    def __init__(self, *params):
+    def __init__(self, *params, field_cache_dir=None, model_cache_dir=None,
+                 checkpoint_path=None, checkpoint_every=10**6,
+                 checkpoint_preview=False, seed=None,
+                 train_processes=None, model_file=None,
+                 thumbnail_cache_dir=None, capture_path=None,
+                 capture_every=None, color_model='channels',
+                 num_codes=joint.NUM_CODES):
         (train_region_size, train_region_func, train_palette_size, 
          gen_region_size, gen_pixel_limit, shape_strength_x, shape_strength_y, 
          shape_func, palette_paths, output_dims, _, _) = params
@@ -23,7 +52,28 @@ class Model(object):
         (self.width, self.height) = output_dims
         self.palette_paths = palette_paths
         self.train_palette_size = train_palette_size
-        self.floodfill_wts_func = lambda x,y: shape_func(x,y, self.width, self.height, shape_strength_x, shape_strength_y)
+        self.train_region_size = train_region_size
+        # where to keep trained models between runs, None for no caching
+        self.model_cache_dir = model_cache_dir
+        # how many processes to train with, None for one per core
+        self.train_processes = train_processes
+        # if set, a model library (see training.py) to add the palette to
+        # and draw from, instead of the model cache
+        self.model_file = model_file
+        # where to keep resized training images between runs, None for no
+        # caching
+        self.thumbnail_cache_dir = thumbnail_cache_dir
+        # channels samples each color channel on its own (see markov.py),
+        # joint samples whole colors from a codebook of num_codes colors
+        # (see joint.py)
+        self.color_model = color_model
+        self.num_codes = num_codes
+        self.code_table = None # set by set_trained_joint
+        self.shape_func = shape_func
+        (self.shape_strength_x, self.shape_strength_y) = (shape_strength_x,
+                                                          shape_strength_y)
+        # where to keep shape fields between runs, None for memory only
+        self.field_cache_dir = field_cache_dir
         
         self.gen_region_size = gen_region_size
         self.train_region_func = train_region_func
@@ -31,114 +81,472 @@ class Model(object):
         self.gen_pixel_limit = min(gen_pixel_limit,
                                    self.width * self.height)
         self.default_region_func = util.surrounding_region
+        self.wts_field = None # loaded by generate if not set already
+        self.show_progress = True
+        # if checkpoint_path is set, save the generation state there every
+        # checkpoint_every pixels (and a preview image next to it if asked)
+        self.checkpoint_path = checkpoint_path
+        self.checkpoint_every = checkpoint_every
+        self.checkpoint_preview = checkpoint_preview
+        # if capture_path is set, record a time-lapse there with a frame
+        # every capture_every pixels (default: about 300 frames), see
+        # capture.py
+        self.capture_path = capture_path
+        self.capture_every = capture_every
+        self.capture_order = None
+        # every random choice in generation comes from rng, so the same seed
+        # always draws the same picture. None seeds it from the OS.
+        self.set_seed(seed)
+
+    def set_seed(self, seed):
+        self.rng = BufferedRandom(seed)
+
+    def __getstate__(self):
+        # So we can send models to other processes (copy.copy uses this too).
+        # train_region_func is usually a lambda, which can't be pickled, but
+        # it's only needed for training, and the result image is rebuilt by
+        # generate. Methods replaced on this instance (by the profiler) would
+        # still run on this model, so copies go back to the plain ones.
+        state = self.__dict__.copy()
+        for name in ['train_region_func', 'result_buffer', 'result_view',
+                     'result_array']:
+            state.pop(name, None)
+        for name in list(state):
+            if hasattr(type(self), name):
+                state.pop(name)
+        return state
+
+    def window(self, x0, y0, width, height):
+        # A copy of this (trained) model that draws the width x height part
+        # of the canvas with upper left corner (x0, y0), using that part of
+        # our shape field
+        if self.wts_field is None:
+            self.load_shape_field()
+        model = copy.copy(self)
+        (model.width, model.height) = (width, height)
+        model.gen_pixel_limit = width * height
+        model.show_progress = False
+        model.checkpoint_path = None
+        model.capture_path = None
+        model.wts_field = self.wts_field[y0:y0 + height, x0:x0 + width]
+        return model
+
+    def train_from_image(self, image):
+        training.count_image(image, self.train_palette_size,
+                             markov.region_offsets(self.train_region_func),
+                             self.counts)
 
-    def train_from_pixel(self, pixels, x, y, train_width, train_height):
-        (r, g, b) = pixels[x,y]
-        adj_points = self.train_region_func(x, y)
-        for (adj_x, adj_y) in adj_points:
-            if (0 <= adj_x <= train_width - 1
-                and 0 <= adj_y <= train_height - 1):
-                (adj_r, adj_g, adj_b) = pixels[adj_x, adj_y]
-                util.append_to_dict(self.red_model, r, adj_r)
-                util.append_to_dict(self.green_model, g, adj_g)
-                util.append_to_dict(self.blue_model, b, adj_b)
-    
     def train_palette(self):
-        self.red_model = dict()
-        self.green_model = dict()
-        self.blue_model = dict()
-
-        for image_path in self.palette_paths: # local path, not full path
-            image = Image.open(image_path)
-            # want to resize so that dimension ratio is maintained, but the
-            # number of pixels is now self.train_palette_size
-            image = util.resize_intelligently(image, self.train_palette_size)
-            (new_width, new_height) = image.size
-            pixels = image.load()
-            # First, do the markov-chain-style conditioning
-            for x in range(new_width):
-                for y in range(new_height):
-                    self.train_from_pixel(pixels, x, y, new_width, new_height)
-                                          
-    def generate_from_one_neighbor(self, prev_x, prev_y):
-        (prev_r, prev_g, prev_b) = self.result_pixels[prev_x, prev_y]
-        prev_r = util.closest_val_in_dict(self.red_model, prev_r)
-        prev_g = util.closest_val_in_dict(self.green_model, prev_g)
-        prev_b = util.closest_val_in_dict(self.blue_model, prev_b)
-
-        r = random.choice(self.red_model[prev_r])
-        g = random.choice(self.green_model[prev_g])
-        b = random.choice(self.blue_model[prev_b])
+        offsets = markov.region_offsets(self.train_region_func)
+        if self.color_model == 'joint':
+            self.train_joint(offsets)
+            return
+        if self.model_file is not None:
+            self.set_trained(training.update_library(
+                self.model_file, self.palette_paths, self.train_region_size,
+                self.train_palette_size, offsets, self.train_processes,
+                self.thumbnail_cache_dir))
+            return
+        self.counts = None
+        if self.model_cache_dir is not None:
+            key = cache.model_key(self.palette_paths, self.train_region_size,
+                                  self.train_palette_size, offsets)
+            self.counts = cache.load_model(self.model_cache_dir, key)
+            if self.counts is not None:
+                print("Loaded trained model from cache")
+        if self.counts is None:
+            self.counts = training.train_counts(
+                self.palette_paths, self.train_palette_size, offsets,
+                self.train_processes, self.thumbnail_cache_dir)
+            if self.model_cache_dir is not None:
+                cache.save_model(self.model_cache_dir, key, self.counts)
+        self.set_trained(self.counts)
+
+    def set_trained(self, counts, compiled = None):
+        # Use already trained counts (e.g. from another process) instead of
+        # calling train_palette. compiled is markov.compile_counts(counts),
+        # if the caller already has it.
+        self.counts = counts
+        if compiled is None:
+            compiled = markov.compile_counts(counts)
+        # trained_vals[channel] is the values we saw in training, and
+        # tables[channel][prev] is what to sample from given a neighbor value
+        (self.trained_vals, self.tables) = compiled
+
+    def train_joint(self, offsets):
+        # train_palette for the joint color model. Model files are only for
+        # the channels model, but the model cache works the same way.
+        trained = None
+        if self.model_cache_dir is not None:
+            key = cache.hash_key('joint', cache.model_key(
+                self.palette_paths, self.train_region_size,
+                self.train_palette_size, offsets), self.num_codes,
+                joint.LUT_BITS)
+            trained = cache.load_joint_model(self.model_cache_dir, key)
+            if trained is not None:
+                print("Loaded trained model from cache")
+        if trained is None:
+            trained = joint.train(self.palette_paths, self.train_palette_size,
+                                  offsets, self.num_codes,
+                                  self.thumbnail_cache_dir)
+            if self.model_cache_dir is not None:
+                cache.save_joint_model(self.model_cache_dir, key, *trained)
+        self.set_trained_joint(*trained)
+
+    def set_trained_joint(self, codebook, counts, compiled = None):
+        # set_trained for the joint color model. compiled is
+        # joint.compile_counts(counts, codebook), if the caller has it.
+        self.color_model = 'joint'
+        (self.codebook, self.counts) = (codebook, counts)
+        if compiled is None:
+            compiled = joint.compile_counts(counts, codebook)
+        # code_table[code] is what to sample the next code from given a
+        # neighbor with that code, nearest_code[joint.lut_index(r, g, b)]
+        # is the code of (r, g, b), and code_colors[code] is its color
+        (self.trained_codes, self.code_table, nearest_code) = compiled
+        self.nearest_code = nearest_code.tobytes() # indexes to plain ints
+        self.code_colors = [tuple(color) for color in codebook.tolist()]
+
+    def generate_from_one_neighbor(self, prev):
+        # prev is the neighbor's index, y * width + x
+        i = 3 * prev
+        result_view = self.result_view
+        (prev_r, prev_g, prev_b) = (result_view[i], result_view[i + 1],
+                                    result_view[i + 2])
+        (red_table, green_table, blue_table) = self.tables
+        rand = self.rng.random
+        r = markov.sample_row(red_table[prev_r], rand())
+        g = markov.sample_row(green_table[prev_g], rand())
+        b = markov.sample_row(blue_table[prev_b], rand())
         return (r, g, b)
 
-    def generate_one_pixel(self, x, y, seen_pixels, region_func):
-        adj_points = region_func(x, y, self.gen_region_size)
+    def generate_from_one_neighbor_joint(self, prev):
+        # the same for the joint color model, with one draw for all channels
+        i = 3 * prev
+        result_view = self.result_view
+        code = self.nearest_code[joint.lut_index(
+            result_view[i], result_view[i + 1], result_view[i + 2])]
+        return self.code_colors[markov.sample_row(self.code_table[code],
+                                                  self.rng.random())]
+
+    def load_region(self, region_func):
+        # region_func's region for gen_region_size, as (dx, dy) offsets and
+        # as offsets into the flat pixel arrays, worked out once instead of
+        # for every pixel
+        self.gen_offsets = util.region_offsets(region_func,
+                                               self.gen_region_size)
+        self.gen_flat_offsets = [dy * self.width + dx
+                                 for (dx, dy) in self.gen_offsets]
+        # and the points 1 pixel away, which the floodfill goes to next
+        self.step_offsets = util.region_offsets(region_func, 1)
+
+    def generate_one_pixel(self, x, y, seen_pixels):
+        (width, height) = (self.width, self.height)
+        n = self.gen_region_size
+        pixel = y * width + x
+        if n <= x < width - n and n <= y < height - n:
+            # the whole region is on the canvas, so no bounds checks
+            adj_pixels = [pixel + offset for offset in self.gen_flat_offsets
+                          if seen_pixels[pixel + offset]]
+        else:
+            adj_pixels = [pixel + dy * width + dx
+                          for (dx, dy) in self.gen_offsets
+                          if (0 <= x + dx < width and 0 <= y + dy < height
+                              and seen_pixels[pixel + dy * width + dx])]
+        if self.code_table is None:
+            generate_from_one_neighbor = self.generate_from_one_neighbor
+        else:
+            generate_from_one_neighbor = self.generate_from_one_neighbor_joint
         (acc_r, acc_g, acc_b) = (0, 0, 0)
         wt_sum = 0
-        for (adj_x, adj_y) in adj_points:
-            if (0 <= adj_x <= self.width - 1
-                and 0 <= adj_y <= self.height - 1
-                and (adj_x, adj_y) in seen_pixels):
-                (r, g, b) = self.generate_from_one_neighbor(adj_x, adj_y)
-                wt = 1
-                acc_r += r * wt
-                acc_g += g * wt
-                acc_b += b * wt
-                wt_sum += wt
-        if wt_sum == 0: # haven't seen any neighbors yet, so can't predict
-            new_r = random.choice(list(self.red_model.keys()))
-            new_g = random.choice(list(self.green_model.keys()))
-            new_b = random.choice(list(self.blue_model.keys()))
+        for adj_pixel in adj_pixels:
+            (r, g, b) = generate_from_one_neighbor(adj_pixel)
+            wt = 1
+            acc_r += r * wt
+            acc_g += g * wt
+            acc_b += b * wt
+            wt_sum += wt
+        if wt_sum == 0 and self.code_table is not None:
+            # haven't seen any neighbors yet, so pick a trained color
+            (new_r, new_g, new_b) = self.code_colors[
+                self.rng.choice(self.trained_codes)]
+        elif wt_sum == 0: # haven't seen any neighbors yet, so can't predict
+            new_r = self.rng.choice(self.trained_vals[0])
+            new_g = self.rng.choice(self.trained_vals[1])
+            new_b = self.rng.choice(self.trained_vals[2])
         else:
             new_r = int(round(float(acc_r)/wt_sum))
             new_g = int(round(float(acc_g)/wt_sum))
             new_b = int(round(float(acc_b)/wt_sum))
-        self.result_pixels[x,y] = (new_r, new_g, new_b)
-        seen_pixels.add((x,y))
+        i = 3 * pixel
+        result_view = self.result_view
+        result_view[i] = new_r
+        result_view[i + 1] = new_g
+        result_view[i + 2] = new_b
+        seen_pixels[pixel] = 1
+        self.num_seen += 1
+        if self.capture_order is not None:
+            self.capture_order.append(pixel)
                
-    def actually_floodfill(self, region_func, x, y, seen_pixels, remaining_pixels):
+    def floodfill_visit(self, region_func, x, y, seen_pixels, stack):
         # progress update
         total_pixels = self.width * self.height
-        if len(seen_pixels) % (total_pixels // 10) == 0 and len(seen_pixels) > 0:
-            print("%d%% done" % (100 * len(seen_pixels) // total_pixels))
+        progress_step = max(total_pixels // 10, 1)
+        if (self.show_progress and self.num_seen % progress_step == 0
+            and self.num_seen > 0):
+            print("%d%% done" % (100 * self.num_seen // total_pixels))
         # now do the actual stuff
-        if len(seen_pixels) >= self.gen_pixel_limit:
+        if self.num_seen >= self.gen_pixel_limit:
+            return False
+        self.generate_one_pixel(x, y, seen_pixels)
+        # traverse neighbors in random order
+        wts = self.wts_field[y, x].tolist()
+        order = util.weighted_random_shuffle4(range(4), wts, self.rng.random)
+        packed_order = (order[0] | (order[1] << 2) | (order[2] << 4)
+                        | (order[3] << 6))
+        stack.append((((y * self.width + x) << ORDER_BITS) | packed_order)
+                     << TRIED_BITS)
+        if (self.checkpoint_path is not None
+            and self.num_seen % self.checkpoint_every == 0):
+            self.save_checkpoint()
+        return True
+
+    def actually_floodfill(self, region_func, seen_pixels, stack):
+        # Depth-first floodfill, continuing from whatever is on the stack.
+        # This used to be recursive, but that needed a huge thread stack for
+        # large outputs, so now we keep the recursion stack ourselves (packed,
+        # see TRIED_BITS). The visit order is the same.
+        (width, height) = (self.width, self.height)
+        step_offsets = self.step_offsets
+        while stack:
+            frame = stack[-1]
+            tried = frame & TRIED_MASK
+            if tried == 4: # done with all of this pixel's neighbors
+                stack.pop()
+                continue
+            stack[-1] = frame + 1
+            (dx, dy) = step_offsets[(frame >> (TRIED_BITS + 2 * tried)) & 3]
+            pixel = frame >> (TRIED_BITS + ORDER_BITS)
+            adj_x = pixel % width + dx
+            adj_y = pixel // width + dy
+            # if it's in bounds and we haven't seen it
+            if (0 <= adj_x < width and 0 <= adj_y < height and
+                not seen_pixels[adj_y * width + adj_x]):
+                if not self.floodfill_visit(region_func, adj_x, adj_y,
+                                            seen_pixels, stack):
+                    return # hit gen_pixel_limit
+
+    def next_seed(self, seen_pixels):
+        # Walk through the pixels in a scrambled order (see
+        # random_permutation.py) until we find one we haven't seen, so seeds
+        # land all over the canvas. Since the cursor only moves forward this
+        # is O(1) amortized. seed_cursor counts first_seeds, then positions
+        # in seed_order.
+        num_first = len(self.first_seeds)
+        while self.seed_cursor < num_first:
+            i = int(self.first_seeds[self.seed_cursor])
+            self.seed_cursor += 1
+            if not seen_pixels[i]:
+                return (i % self.width, i // self.width)
+        (i, position) = self.seed_order.next_unmarked(
+            self.seed_cursor - num_first,
+            np.frombuffer(seen_pixels, dtype=np.uint8))
+        self.seed_cursor = num_first + position
+        if i is None:
+            return None
+        return (i % self.width, i // self.width)
+
+    def make_seed_order(self):
+        # The scrambled order that next_seed walks through. It only depends on
+        # seed_order_seed and known_mask, so checkpoints don't need to store
+        # it, and it's worked out as we go, so it takes no memory per pixel.
+        self.seed_order = RandomPermutation(self.width * self.height,
+                                            self.seed_order_seed)
+        self.first_seeds = np.zeros(0, dtype=np.int64)
+        if self.known_mask is not None:
+            # start from the pixels touching the known ones, so that the fill
+            # grows out of them instead of starting from random colors
+            touching = util.touching_mask(self.known_mask, self.width,
+                                          self.height)
+            self.first_seeds = np.flatnonzero(touching)
+            np.random.default_rng(self.seed_order_seed).shuffle(
+                self.first_seeds)
+
+    # this is a wrapper, the main function is actually_floodfill
+    def generate_floodfill(self, region_func, known_mask = None):
+        (width, height) = (self.width, self.height)
+
+        # seen_pixels[y * width + x] is 1 once (x, y) has been generated, or
+        # if it was already known (see generate)
+        if known_mask is None:
+            self.seen_pixels = bytearray(width * height)
+        else:
+            self.seen_pixels = bytearray(known_mask)
+        self.num_seen = self.seen_pixels.count(1)
+        self.num_known = self.num_seen
+        self.num_seeds = 0 # how many separate fills we've started
+        self.known_mask = known_mask
+        self.seed_order_seed = self.rng.seed_int()
+        self.seed_cursor = 0
+        self.stack = array.array('q')
+        self.continue_floodfill(region_func)
+
+    def continue_floodfill(self, region_func):
+        seen_pixels = self.seen_pixels
+        stack = self.stack
+        self.load_region(region_func)
+        self.make_seed_order()
+        while True:
+            # finish the current fill (if we're resuming in the middle of one)
+            self.actually_floodfill(region_func, seen_pixels, stack)
+            if self.num_seen >= self.gen_pixel_limit:
+                break
+            seed = self.next_seed(seen_pixels)
+            if seed is None: # every pixel has been generated
+                break
+            (seed_x, seed_y) = seed
+            self.num_seeds += 1
+            if not self.floodfill_visit(region_func, seed_x, seed_y,
+                                        seen_pixels, stack):
+                break
+
+    @property
+    def num_generated(self):
+        return self.num_seen - self.num_known
+
+    def checkpoint_state(self):
+        # everything continue_floodfill needs to pick up exactly where we are
+        # now, given the same trained model and shape field
+        known_mask = (np.zeros(0, dtype=np.uint8) if self.known_mask is None
+                      else np.frombuffer(self.known_mask, dtype=np.uint8))
+        return {'result': self.result_array,
+                'seen_pixels': np.frombuffer(self.seen_pixels, dtype=np.uint8),
+                'known_mask': known_mask,
+                'stack': np.array(self.stack, dtype=np.int64),
+                'num_seen': self.num_seen,
+                'num_known': self.num_known,
+                'num_seeds': self.num_seeds,
+                'seed_order_seed': self.seed_order_seed,
+                'seed_cursor': self.seed_cursor,
+                'random_state': self.rng.getstate()}
+
+    def restore_state(self, state):
+        (height, width, _) = state['result'].shape
+        if (width, height) != (self.width, self.height):
+            raise ValueError("Checkpoint is for a %dx%d picture, not %dx%d" %
+                             (width, height, self.width, self.height))
+        if 'stack' not in state:
+            raise ValueError("Checkpoint is from an older version, with a "
+                             "different stack format")
+        self.new_result_buffer()
+        self.result_array[:] = state['result']
+        self.seen_pixels = bytearray(state['seen_pixels'].tobytes())
+        self.known_mask = (state['known_mask'].tobytes()
+                           if len(state['known_mask']) > 0 else None)
+        self.stack = array.array('q', state['stack'].astype(np.int64).tobytes())
+        self.num_seen = state['num_seen']
+        self.num_known = state['num_known']
+        self.num_seeds = state['num_seeds']
+        self.seed_order_seed = state['seed_order_seed']
+        self.seed_cursor = state['seed_cursor']
+        self.rng.setstate(state['random_state'])
+
+    def save_checkpoint(self):
+        preview = self.result_to_image() if self.checkpoint_preview else None
+        checkpoint.save(self.checkpoint_path, self.checkpoint_state(), preview)
+        if self.show_progress:
+            print("Saved checkpoint to %s" % self.checkpoint_path)
+
+    def start_capture(self):
+        # capture_order is the flat index of each pixel we generate, in order
+        self.capture_order = (None if self.capture_path is None
+                              else array.array('I'))
+
+    def save_capture(self):
+        if self.capture_path is None:
             return
+        frame_every = self.capture_every or max(len(self.capture_order) // 300,
+                                                1)
+        capture.save(self.capture_path, self.capture_order, self.result_array,
+                     frame_every)
+        if self.show_progress:
+            print("Saved capture of %d pixels to %s" %
+                  (len(self.capture_order), self.capture_path))
+
+    def load_shape_field(self):
+        # wts_field[y, x] is the shape_func wts for (x, y)
+        field = shape_funcs.shape_field(
+            self.shape_func, self.width, self.height, self.shape_strength_x,
+            self.shape_strength_y, cache_dir=self.field_cache_dir)
+        if field.min() < 1: # must be positive, let's say at least 1
+            field = np.maximum(field, 1)
+        self.wts_field = field
+
+    def new_result_buffer(self):
+        # The picture is generated into one contiguous block of bytes, r, g, b
+        # for each pixel in row major order. result_view is a flat memoryview
+        # of it for fast per-pixel access and result_array is a
+        # (height, width, 3) numpy view of the same memory.
+        self.result_buffer = bytearray(self.width * self.height * 3)
+        self.result_view = memoryview(self.result_buffer).cast('B')
+        self.result_array = np.frombuffer(self.result_view, dtype=np.uint8)
+        self.result_array = self.result_array.reshape(self.height, self.width, 3)
+
+    def result_to_image(self):
+        # the only conversion to PIL, done once at the end
+        return Image.frombuffer('RGB', (self.width, self.height),
+                                self.result_view, 'raw', 'RGB', 0, 1)
+
+    def generate(self, known_pixels = None, known_mask = None,
+                 resume_path = None):
+        # known_pixels ((height, width, 3) uint8) and known_mask let the
+        # caller fix some pixels ahead of time (known_mask[y * width + x] is
+        # 1 for those). We condition on them but never overwrite them; the
+        # tiled mode uses this for the margins it shares with neighboring
+        # tiles.
+        # resume_path is a checkpoint from save_checkpoint to continue from.
+        # With capture_path set, a resumed run only captures what it generates.
+        if self.wts_field is None:
+            self.load_shape_field()
+        self.start_capture()
+        if resume_path is not None:
+            self.restore_state(checkpoint.load(resume_path))
+            print("Resuming from %s with %d pixels done" %
+                  (resume_path, self.num_seen))
+            self.continue_floodfill(self.default_region_func)
         else:
-            self.generate_one_pixel(x, y, seen_pixels, region_func)
-            adj_points = region_func(x, y, 1) # get all points 1 pixel away
-            # traverse neighbors in random order
-            wts = self.floodfill_wts_func(x,y)
-            wts = [max(wt, 1) for wt in wts] # must be positive, let's say at least 1
-            adj_points = util.weighted_random_shuffle(adj_points, wts)
-            for (adj_x, adj_y) in adj_points:
-                # if we haven't seen it, it's in bounds, and it's allowed
-                if ((adj_x, adj_y) not in seen_pixels and
-                    0 <= adj_x <= self.width - 1 and
-                    0 <= adj_y <= self.height - 1 and
-                    (adj_x, adj_y) in remaining_pixels):
-                    self.actually_floodfill(region_func, adj_x, 
-                                            adj_y, seen_pixels, remaining_pixels)
-            
-    # this is a wrapper, the main function is actually_floodfill
-    def generate_floodfill(self, region_func):
-        (width, height) = self.result_image.size
-        remaining_pixels = util.get_all_pixels(width, height)
-        self.result_pixels = self.result_image.load()      
-
-        seen_pixels = set()
-        while (len(remaining_pixels) > 0 and
-                len(seen_pixels) < self.gen_pixel_limit):        
-            (seed_x, seed_y) = random.choice(list(remaining_pixels))
-            util.call_with_large_stack(self.actually_floodfill, region_func,
-                                    seed_x, seed_y, seen_pixels, remaining_pixels)
-            remaining_pixels -= seen_pixels     
-                  
-    def generate(self):
-        self.result_image = Image.new('RGB', (self.width, self.height))
-        self.generate_floodfill(self.default_region_func)
-        return self.result_image
+            self.new_result_buffer()
+            if known_pixels is not None:
+                self.result_array[:] = known_pixels
+            self.generate_floodfill(self.default_region_func, known_mask)
+        self.save_capture()
+        return self.result_to_image()
                                 
+# the shapes you can ask for on the command line
+SHAPES = {'circle': shape_funcs.circle,
+          'fractal': shape_funcs.uniform,
+          'cosine': shape_funcs.cosine,
+          'heart': shape_funcs.heart,
+          'outward': shape_funcs.outward,
+          'squiggles': shape_funcs.squiggles}
+
+def make_params(shape_func, palette_files, train_region_size, result_size,
+                shape_strength, palette_short_dir = 'input/gradients'):
+    # Fills in the non-user parameters (see set_parameters) and returns the
+    # params tuple that Model expects
+    train_region_func = lambda x,y: util.surrounding_region(x,y,train_region_size)
+    train_palette_size = 50*50
+    (width, height) = (result_size, result_size)
+    output_dims = (width, height)
+    gen_region_size = train_region_size
+    gen_pixel_limit = width * height
+    (shape_strength_x, shape_strength_y) = (shape_strength, shape_strength)
+    palette_paths = util.get_input_paths(palette_short_dir, palette_files)
+    return (train_region_size, train_region_func, train_palette_size,
+            gen_region_size, gen_pixel_limit, shape_strength_x, shape_strength_y, 
+            shape_func, palette_paths, output_dims, palette_files, 
+            palette_short_dir)
+
 def set_parameters():
     """
     PARAMETER DESCRIPTION
@@ -172,73 +580,163 @@ def set_parameters():
     try:
         parser.add_argument('--shape', '-s', help="Desired shape to draw. Currently supported options are circle, fractal, cosine, outward", type=str, default= 'circle')
         parser.add_argument('--training_files', '-f', help="comma separated list of filenames in ./gradients folder", type=str, default='gradient3.jpg')
+        parser.add_argument('--training_dir', help="train on every image in this directory (e.g. input/people) instead of --training_files", type=str, default=None)
+        parser.add_argument('--train_processes', help="number of processes for training on many images. Defaults to the number of cores", type=int, default=None)
+        parser.add_argument('--model_file', help="model library to add the training images to and generate from. Images it has already been trained on are skipped, so it can keep growing", type=str, default=None)
+        parser.add_argument('--color_model', help="channels (the default) samples the red, green and blue of each pixel separately. joint samples whole colors from a codebook of the palette's colors, so it stays closer to the palette. joint only works with --mode dfs, with or without --tile_size", type=str, choices=['channels', 'joint'], default='channels')
+        parser.add_argument('--num_colors', help="for --color_model joint, how many colors the codebook has, at most 256", type=int, default=joint.NUM_CODES)
         parser.add_argument('--train_region_size', '-t', help="how many neighboring pixels to use in training", type=int, default=2)
         parser.add_argument('--result_size', '-r', help="width and height of output", type=int, default=500)       
         parser.add_argument('--viz_vector_field', '-v', help="visualize the vector field of the chosen shape", action='store_true', default=False)    
+        parser.add_argument('--viz_output', help="write the vector field visualization to this image file instead of showing it", type=str, default=None)
+        parser.add_argument('--no_display', help="don't show the picture when it's done, just save it", action='store_true', default=False)
         parser.add_argument('--shape_strength', '-g', help='how aggressively to pursue the shape. Value of 1 means that we mostly ignore the shape. Default is 100.', type=int, default=100)        
+        parser.add_argument('--mode', help="dfs (the default) fills one pixel at a time depth first. wavefront fills batches of pixels along the edge of the filled region at once, which is much faster for big pictures. pyramid fills a small version depth first and then refines it up to full size, which is fastest for huge pictures", type=str, choices=['dfs', 'wavefront', 'pyramid'], default='dfs')
+        parser.add_argument('--coarse_size', help="for --mode pyramid, the largest size to fill depth first before refining", type=int, default=512)
+        parser.add_argument('--tile_size', help="generate the picture in tiles of this size on several cores. 0 (the default) generates it all at once", type=int, default=0)
+        parser.add_argument('--processes', '-p', help="number of processes for tiled generation. Defaults to the number of cores", type=int, default=None)
+        parser.add_argument('--checkpoint', help="save the generation state to this file as we go, so the run can be resumed with --resume", type=str, default=None)
+        parser.add_argument('--checkpoint_every', help="how many pixels to generate between checkpoints", type=int, default=10**6)
+        parser.add_argument('--checkpoint_preview', help="also save the partial picture with each checkpoint", action='store_true', default=False)
+        parser.add_argument('--resume', help="continue from this checkpoint. The other options must match the original run", type=str, default=None)
+        parser.add_argument('--capture', help="record a time-lapse of generation to this file, see capture.py to turn it into an animation. Not supported with --tile_size or --mode pyramid", type=str, default=None)
+        parser.add_argument('--capture_every', help="pixels per frame of the time-lapse. Defaults to about 300 frames", type=int, default=None)
+        parser.add_argument('--profile', help="print how long each phase took, pixels per second, and peak memory", action='store_true', default=False)
+        parser.add_argument('--profile_json', help="also write the profile to this JSON file", type=str, default=None)
+        parser.add_argument('--model_cache_dir', help="directory for caching trained models between runs", type=str, default='cache/models')
+        parser.add_argument('--no_model_cache', help="always retrain the model instead of using the cache", action='store_true', default=False)
+        parser.add_argument('--seed', help="random seed. The same seed and options always draw the same picture. By default every run is different", type=int, default=None)
+        parser.add_argument('--thumbnail_cache_dir', help="directory for caching resized training images between runs", type=str, default='cache/thumbnails')
+        parser.add_argument('--no_thumbnail_cache', help="always decode and resize the training images instead of using the cache", action='store_true', default=False)
+        parser.add_argument('--field_cache_dir', help="directory for caching shape fields between runs. By default they are only cached in memory", type=str, default=None)
         args = parser.parse_args()
         result_size = args.result_size
         train_region_size = args.train_region_size
         palette_files = args.training_files.split(',')
-        shape_func = (shape_funcs.circle if args.shape == 'circle' else
-                    shape_funcs.uniform if args.shape == 'fractal' else
-                    shape_funcs.cosine if args.shape == 'cosine' else
-                    shape_funcs.heart if args.shape == 'heart' else
-                    shape_funcs.outward if args.shape == 'outward' else
-                    shape_funcs.squiggles if args.shape == 'squiggles' else
-                    1/0)
-        shape_strength_x = args.shape_strength
-        shape_strength_y = args.shape_strength        
+        palette_short_dir = 'input/gradients'
+        if args.training_dir is not None:
+            palette_short_dir = args.training_dir
+            palette_files = training.list_images(palette_short_dir)
+        shape_func = SHAPES[args.shape]
+        shape_strength = args.shape_strength
     except:
         print("Invalid command line args, exiting")
         exit()
+    # checked out here so the message isn't swallowed by the except above
+    if not 1 <= args.num_colors <= joint.NUM_CODES:
+        print("--num_colors must be between 1 and %d, not %d, exiting" %
+              (joint.NUM_CODES, args.num_colors))
+        exit()
     # END USER PARAMETERS
 
-    # BEGIN NON-USER PARAMETERS
-    train_region_func = lambda x,y: util.surrounding_region(x,y,train_region_size)
-    train_palette_size = 50*50
-    (width, height) = (result_size, result_size)
-    output_dims = (width, height)
-    gen_region_size = train_region_size
-    gen_pixel_limit = width * height
-    palette_short_dir = 'input/gradients'
-    palette_paths = util.get_input_paths(palette_short_dir, palette_files)
-    # END NON-USER PARAMETERS
+    # NON-USER PARAMETERS are set in make_params
+    params = make_params(shape_func, palette_files, train_region_size,
+                         result_size, shape_strength, palette_short_dir)
 
-    if args.viz_vector_field:
-        shape_funcs.visualize_vector_field(shape_func, width, height, 
-                                           shape_strength_x, shape_strength_y)    
+    if args.viz_vector_field or args.viz_output is not None:
+        shape_funcs.visualize_vector_field(shape_func, result_size,
+                                           result_size, shape_strength,
+                                           shape_strength, args.viz_output)
+        if args.viz_output is not None:
+            print("Saved vector field to %s" % args.viz_output)
 
-    params = (train_region_size, train_region_func, train_palette_size,
-            gen_region_size, gen_pixel_limit, shape_strength_x, shape_strength_y, 
-            shape_func, palette_paths, output_dims, palette_files, 
-            palette_short_dir)
-    return params
+    # how to generate, which doesn't change what we draw
+    generate_options = {'mode': args.mode,
+                        'tile_size': args.tile_size,
+                        'processes': args.processes,
+                        'coarse_size': args.coarse_size,
+                        'resume_path': args.resume,
+                        'profile': args.profile or args.profile_json is not None,
+                        'profile_json': args.profile_json,
+                        'training_dir': args.training_dir,
+                        'display': not args.no_display}
+    # extra Model options that don't affect what we draw
+    options = {'field_cache_dir': args.field_cache_dir,
+               'checkpoint_path': args.checkpoint,
+               'checkpoint_every': args.checkpoint_every,
+               'checkpoint_preview': args.checkpoint_preview,
+               'capture_path': args.capture,
+               'capture_every': args.capture_every,
+               'model_cache_dir': (None if args.no_model_cache
+                                   else args.model_cache_dir),
+               'train_processes': args.train_processes,
+               'num_codes': args.num_colors,
+               'model_file': args.model_file,
+               'thumbnail_cache_dir': (None if args.no_thumbnail_cache
+                                       else args.thumbnail_cache_dir)}
+    # these do change what we draw
+    options['seed'] = args.seed
+    options['color_model'] = args.color_model
+    return (params, options, generate_options)
 
 def main():
-    params = set_parameters()
+    (params, options, generate_options) = set_parameters()
     (train_region_size, train_region_func, train_palette_size, gen_region_size,
      gen_pixel_limit, shape_strength_x, shape_strength_y, shape_func, palette_paths, 
      output_dims, palette_files, palette_short_dir) = params
-    
-    # initialize canvas    
-    root = Tk()  
-    (width, height) = output_dims
-    canvas = Canvas(root, width = width, height = height)
-    canvas.pack()
-    model = Model(*params)
+
+    if options['color_model'] == 'joint':
+        if generate_options['mode'] != 'dfs':
+            print("--mode %s doesn't support --color_model joint, using dfs" %
+                  generate_options['mode'])
+            generate_options['mode'] = 'dfs'
+        if options['model_file'] is not None:
+            print("--model_file isn't supported with --color_model joint, "
+                  "ignoring")
+            options['model_file'] = None
+    model = Model(*params, **options)
+    profiler = profiling.Profiler(enabled=generate_options['profile'])
+    profiler.wrap(model, 'generate_one_pixel')
+    profiler.wrap(model, 'load_shape_field', 'shape_weights')
     print("Training model...")
-    model.train_palette()
+    with profiler.phase('train'):
+        model.train_palette()
     print("Generating image...")    
-    image = model.generate()
+    with profiler.phase('generate'):
+        if generate_options['tile_size'] > 0:
+            if options['checkpoint_path'] or generate_options['resume_path']:
+                print("Checkpoints aren't supported with --tile_size, ignoring")
+            if options['capture_path']:
+                print("--capture isn't supported with --tile_size, ignoring")
+            image = tiling.generate_tiled(model, generate_options['tile_size'],
+                                          generate_options['processes'])
+        elif generate_options['mode'] == 'wavefront':
+            if options['checkpoint_path'] or generate_options['resume_path']:
+                print("Checkpoints aren't supported with --mode wavefront, "
+                      "ignoring")
+            image = wavefront.generate_wavefront(model)
+        elif generate_options['mode'] == 'pyramid':
+            if options['checkpoint_path'] or generate_options['resume_path']:
+                print("Checkpoints aren't supported with --mode pyramid, "
+                      "ignoring")
+            if options['capture_path']:
+                print("--capture isn't supported with --mode pyramid, ignoring")
+            image = pyramid.generate_pyramid(model,
+                                             generate_options['coarse_size'])
+        else:
+            image = model.generate(resume_path=generate_options['resume_path'])
+    if generate_options['tile_size'] == 0:
+        profiler.record_generation(model)
+    if generate_options['training_dir'] is not None:
+        # name the output after the directory, not every file in it
+        palette_files = [os.path.basename(os.path.normpath(palette_short_dir))]
+    # each mode draws a different picture from the same seed
+    mode = generate_options['mode']
+    if generate_options['tile_size'] > 0:
+        mode = 'tiled%d' % generate_options['tile_size']
     output_name = util.make_output_name(
         shape_func, train_region_size, gen_region_size, 
-        train_palette_size, palette_files, shape_strength_x)
+        train_palette_size, palette_files, shape_strength_x,
+        seed=options['seed'], color_model=options['color_model'], mode=mode)
     print("Saving output to %s..." % output_name)    
-    image.save(output_name)
-    tk_image = ImageTk.PhotoImage(image)
-    canvas.create_image(0, 0, anchor = NW, image = tk_image)
-    root.mainloop()
+    with profiler.phase('save'):
+        image.save(output_name)
+    profiler.print_report()
+    if generate_options['profile_json'] is not None:
+        profiler.dump_json(generate_options['profile_json'])
+    if generate_options['display']:
+        (width, height) = output_dims
+        util.show_im(image, width, height)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,136 @@
+# markov.py - color transition model for main.py
+# Author: Ben Plaut
+# Contains the Markov-chain-style color model. For each color channel we keep
+# a dense 256x256 matrix where counts[prev, next] is the number of times a
+# training pixel with value prev had a neighbor with value next. The model is
+# a fixed size no matter how much training data we use: 3 x 256 x 256 uint32
+# counts, 768KB.
+# Required external modules: numpy
+# Required python files: None
+
+import numpy as np
+
+NUM_VALS = 256 # number of possible values for one color channel
+
+def new_counts():
+    # one transition-count matrix per channel, in (r, g, b) order
+    return np.zeros((3, NUM_VALS, NUM_VALS), dtype=np.uint32)
+
+def offset_pairs(pixels, offsets):
+    # Instead of visiting every pixel, for each (dx, dy) offset we line up
+    # the whole image with a shifted copy of itself, so each pixel is paired
+    # with its neighbor at that offset (pairs that would fall off the image
+    # are dropped). Yields (src, dst) views of pixels for each offset.
+    (height, width) = pixels.shape[:2]
+    for (dx, dy) in offsets:
+        if abs(dx) >= width or abs(dy) >= height:
+            continue
+        src = pixels[max(0, -dy):height - max(0, dy),
+                     max(0, -dx):width - max(0, dx)]
+        dst = pixels[max(0, dy):height + min(0, dy),
+                     max(0, dx):width + min(0, dx)]
+        yield (src, dst)
+
+def count_transitions(pixels, offsets, counts):
+    # pixels is a (height, width, 3) uint8 array
+    for (src, dst) in offset_pairs(pixels, offsets):
+        for channel in range(3):
+            pairs = (src[:, :, channel].astype(np.intp) * NUM_VALS
+                     + dst[:, :, channel])
+            counts[channel] += np.bincount(
+                pairs.ravel(), minlength=NUM_VALS * NUM_VALS).reshape(
+                    NUM_VALS, NUM_VALS).astype(np.uint32)
+    return counts
+
+def region_offsets(region_func):
+    # region funcs give the neighbors of a point, so the neighbors of (0,0)
+    # are exactly the offsets
+    return region_func(0, 0)
+
+def nearest_trained_vals(trained_vals):
+    # for every possible value, the closest value we saw in training. Ties go
+    # to the lower value, the same as util.closest_val_in_dict
+    result = [None] * NUM_VALS
+    for val in range(NUM_VALS):
+        result[val] = min(trained_vals, key=lambda trained: (abs(trained - val),
+                                                             trained))
+    return result
+
+def alias_table(vals, wts):
+    # Walker's alias method: split the distribution into len(vals) equally
+    # likely columns, where column i is vals[i] with probability prob[i] and
+    # alias[i] otherwise. Sampling is then one uniform draw, see sample_row.
+    n = len(vals)
+    total = float(sum(wts))
+    scaled = [wt * n / total for wt in wts]
+    prob = [1.0] * n
+    alias = list(vals)
+    small = [i for i in range(n) if scaled[i] < 1.0]
+    large = [i for i in range(n) if scaled[i] >= 1.0]
+    while small and large:
+        (i, j) = (small.pop(), large.pop())
+        prob[i] = scaled[i]
+        alias[i] = vals[j]
+        scaled[j] -= 1.0 - scaled[i]
+        if scaled[j] < 1.0:
+            small.append(j)
+        else:
+            large.append(j)
+    # anything left over is 1 up to rounding error, so it keeps prob 1.0
+    return (n, list(vals), prob, alias)
+
+def compile_channel(channel_counts):
+    # Turns one channel's count matrix into a lookup table with one entry per
+    # possible previous value. Untrained values share the entry of the
+    # nearest trained value, so sampling never has to search for a key.
+    trained_vals = [val for val in range(NUM_VALS) if channel_counts[val].any()]
+    row_tables = dict()
+    for val in trained_vals:
+        row = channel_counts[val]
+        next_vals = np.flatnonzero(row).tolist()
+        row_tables[val] = alias_table(next_vals, row[next_vals].tolist())
+    nearest = nearest_trained_vals(trained_vals)
+    table = [row_tables[nearest[val]] for val in range(NUM_VALS)]
+    return (trained_vals, table)
+
+def compile_counts(counts):
+    # compiles all three channels, returns (trained_vals, tables) where each
+    # has one entry per channel
+    compiled = [compile_channel(channel_counts) for channel_counts in counts]
+    return (tuple(trained_vals for (trained_vals, _) in compiled),
+            tuple(table for (_, table) in compiled))
+
+def sample_row(row_table, rand_float):
+    # rand_float is uniform in [0, 1). The integer part of rand_float * n
+    # picks the column and the fractional part decides value vs alias.
+    (n, vals, prob, alias) = row_table
+    scaled = rand_float * n
+    i = int(scaled)
+    return vals[i] if scaled - i < prob[i] else alias[i]
+
+def batch_table(table):
+    # numpy version of a compiled table (from compile_channel), for sampling
+    # many pixels at once with sample_rows_batch. Rows are padded to the
+    # longest one. To sample all channels in one go, pass the channels'
+    # tables concatenated, and offset each channel's values by NUM_VALS times
+    # its index.
+    row_lengths = np.array([n for (n, _, _, _) in table], dtype=np.intp)
+    width = row_lengths.max()
+    vals = np.zeros((len(table), width), dtype=np.uint8)
+    prob = np.ones((len(table), width))
+    alias = np.zeros((len(table), width), dtype=np.uint8)
+    for (prev_val, (n, row_vals, row_prob, row_alias)) in enumerate(table):
+        vals[prev_val, :n] = row_vals
+        prob[prev_val, :n] = row_prob
+        alias[prev_val, :n] = row_alias
+    return (row_lengths, vals, prob, alias)
+
+def sample_rows_batch(batch_table, prev_vals, rand_floats):
+    # Same as sample_row, for an array of previous values and an array of
+    # uniform [0, 1) floats of the same shape
+    (row_lengths, vals, prob, alias) = batch_table
+    n = row_lengths[prev_vals]
+    scaled = rand_floats * n
+    i = np.minimum(scaled.astype(np.intp), n - 1)
+    use_val = scaled - i < prob[prev_vals, i]
+    return np.where(use_val, vals[prev_vals, i], alias[prev_vals, i])
@@ -0,0 +1,113 @@
+# profiling.py - optional timing instrumentation for main.py
+# Author: Ben Plaut
+# Contains the Profiler, which records the wall time of each phase of a run
+# (training, shape weights, generation, saving), how long the per-pixel work
+# takes, pixels per second, the number of floodfill seeds and the average
+# fill size, and peak memory. A disabled Profiler does nothing: phase() is a
+# no-op and wrap() leaves the methods alone, so the per-pixel code pays no
+# cost at all unless profiling was asked for.
+# Required external modules: None
+# Required python files: None
+
+import json
+import sys
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+def peak_memory_mb():
+    try:
+        import resource
+    except ImportError: # not available on Windows
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS reports bytes
+    return peak / 2.0**20 if sys.platform == 'darwin' else peak / 2.0**10
+
+class Profiler(object):
+    def __init__(self, enabled = True):
+        self.enabled = enabled
+        self.phase_seconds = OrderedDict()
+        # for wrapped methods: name -> [number of calls, total seconds]
+        self.call_stats = OrderedDict()
+        self.stats = OrderedDict()
+
+    @contextmanager
+    def phase(self, name):
+        if not self.enabled:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phase_seconds[name] = (self.phase_seconds.get(name, 0)
+                                        + time.perf_counter() - start)
+
+    def wrap(self, obj, method_name, name = None):
+        # Replaces obj.method_name (on this instance only) with a version
+        # that counts calls and adds up their time
+        if not self.enabled:
+            return
+        name = name or method_name
+        method = getattr(obj, method_name)
+        stats = self.call_stats.setdefault(name, [0, 0.0])
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                stats[0] += 1
+                stats[1] += time.perf_counter() - start
+        setattr(obj, method_name, timed)
+
+    def record(self, name, val):
+        if self.enabled:
+            self.stats[name] = val
+
+    def record_generation(self, model):
+        # generation stats that Model keeps track of anyway
+        if not self.enabled:
+            return
+        seconds = self.phase_seconds.get('generate')
+        self.record('pixels_generated', model.num_generated)
+        self.record('floodfill_seeds', model.num_seeds)
+        if model.num_seeds > 0:
+            self.record('average_fill_size',
+                        model.num_generated / float(model.num_seeds))
+        if seconds:
+            self.record('pixels_per_second', model.num_generated / seconds)
+
+    def report(self):
+        result = OrderedDict()
+        result['phase_seconds'] = self.phase_seconds
+        result['calls'] = OrderedDict(
+            (name, {'calls': calls, 'seconds': seconds,
+                    'us_per_call': 1e6 * seconds / calls if calls else None})
+            for (name, (calls, seconds)) in self.call_stats.items())
+        result['stats'] = self.stats
+        result['peak_memory_mb'] = peak_memory_mb()
+        return result
+
+    def print_report(self):
+        if not self.enabled:
+            return
+        report = self.report()
+        print("Profile:")
+        for (name, seconds) in report['phase_seconds'].items():
+            print("  %-20s %10.3fs" % (name, seconds))
+        for (name, call) in report['calls'].items():
+            print("  %-20s %10.3fs  %d calls, %.2fus each" %
+                  (name, call['seconds'], call['calls'],
+                   call['us_per_call'] or 0))
+        for (name, val) in report['stats'].items():
+            print("  %-20s %10.1f" % (name, val))
+        if report['peak_memory_mb'] is not None:
+            print("  %-20s %10.1fMB" % ('peak memory',
+                                         report['peak_memory_mb']))
+
+    def dump_json(self, path):
+        if not self.enabled:
+            return
+        with open(path, 'w') as f:
+            json.dump(self.report(), f, indent=2)
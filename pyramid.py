@@ -0,0 +1,196 @@
+# pyramid.py - coarse to fine generation for main.py
+# Author: Ben Plaut
+# An alternative to filling every pixel of a big picture with the floodfill.
+# The floodfill only runs on a small version of the picture (at most
+# coarse_size on a side, using every few pixels of the shape field). Then the
+# picture is doubled in size until it's full size: the old pixels go at the
+# even (x, y) positions, and the new ones are filled by lots of short
+# floodfills. Each one starts at a random new pixel and takes up to
+# STREAK_LENGTH steps, each to an unfilled neighbor picked by the shape wts,
+# and each pixel it reaches is generated like Model.generate_one_pixel does,
+# from the new pixels around it that are filled (or the old ones, if there
+# aren't any yet). The colors drift along each of these streaks like they do
+# along the floodfill's path, so every level adds brushstrokes of its own
+# size, following the ones from the level below. Then the old pixels are
+# generated again from the new ones, so they don't show as a grid of dots.
+# All the streaks in a band of rows take their steps together, with numpy.
+# Memory is the picture itself plus bands of the shape field, never the whole
+# field at full size.
+# Required external modules: numpy
+# Required python files: markov.py, shape_funcs.py, util.py, wavefront.py
+
+import copy
+import math
+import numpy as np
+import markov
+import shape_funcs
+import util
+import wavefront
+
+BAND_ROWS = 128 # rows of new pixels to fill at once, which bounds memory
+STREAK_LENGTH = 64 # most pixels one of a level's short floodfills fills
+# rows below a band that its streaks can run on into, so strokes don't all
+# stop at the edge of the band
+SPILL_ROWS = 32
+# New pixels are generated from a region at least this big, so they always
+# have an old pixel in it (the centers of squares of old pixels only have
+# diagonal ones)
+MIN_REGION_SIZE = 2
+
+def level_field(model, step, y0, y1):
+    # the shape wts for every step-th pixel of the full canvas in rows
+    # y0 <= y < y1, positive like Model.load_shape_field makes them
+    field = shape_funcs.compute_field(
+        model.shape_func, model.width, model.height, model.shape_strength_x,
+        model.shape_strength_y, step, y0, y1)
+    return np.maximum(field, 1)
+
+def next_pixels(pixels, filled, wts, width, y0, y1, height, rng):
+    # One floodfill step from each of pixels: the unfilled neighbor in rows
+    # y0 <= y < height to go to, picked with probability proportional to the
+    # shape wts. Pixels with nowhere to go, or that pick a neighbor in row
+    # y1 or below, are left out. (Those streaks stop there, rather than
+    # turning along row y1 - 1 and drawing a line.)
+    choice_wts = np.zeros((len(pixels), 4))
+    targets = np.zeros((len(pixels), 4), dtype=np.intp)
+    for (direction, (dx, dy)) in enumerate(wavefront.DIRECTIONS):
+        (adj, valid) = wavefront.neighbors(pixels, dx, dy, width, height)
+        valid &= (adj >= y0 * width) & ~filled[adj]
+        choice_wts[:, direction] = np.where(valid, wts[pixels - y0 * width,
+                                                       direction], 0)
+        targets[:, direction] = adj
+    totals = choice_wts.sum(axis=1)
+    going = totals > 0
+    cumulative = np.cumsum(choice_wts[going], axis=1)
+    picks = (cumulative < (rng.random(going.sum()) * totals[going])[:, np.newaxis])
+    directions = np.minimum(picks.sum(axis=1), 3)
+    targets = targets[going][np.arange(len(directions)), directions]
+    return targets[targets < y1 * width]
+
+def in_region(pixels, mask, region, width, height):
+    # whether each of pixels has a pixel in mask in its region
+    found = np.zeros(len(pixels), dtype=bool)
+    for (dx, dy) in region:
+        (adj, valid) = wavefront.neighbors(pixels, dx, dy, width, height)
+        found |= valid & mask[adj]
+    return found
+
+def fill_level(model, image, step, table, region, rng):
+    # Fills every pixel of image but the even (x, y) ones, which must already
+    # be known, then redoes those from the new pixels around them. step is
+    # how many canvas pixels one pixel of image is.
+    (height, width, _) = image.shape
+    margin = max(dy for (_, dy) in region)
+    # which pixels of the rows the last band spilled into are filled
+    spilled = np.zeros(0, dtype=bool)
+    for band_y0 in range(0, height, BAND_ROWS):
+        band_y1 = min(band_y0 + BAND_ROWS, height)
+        spill_y1 = min(band_y1 + SPILL_ROWS, height)
+        # the band, the rows it can spill into and the rows around them that
+        # their regions reach. Rows above the band are done, and only the old
+        # pixels and the spilled ones below it are known.
+        top = max(band_y0 - margin, 0)
+        (y0, y1, spill_end) = (band_y0 - top, band_y1 - top, spill_y1 - top)
+        window = image[top:min(spill_y1 + margin, height)]
+        pixels = window.reshape(-1, 3)
+        old = np.zeros(window.shape[:2], dtype=bool)
+        old[(top % 2)::2, 0::2] = True
+        old = old.ravel()
+        # the pixels new ones are generated from: the ones done at this
+        # level. The old pixels are only used where there are none of those
+        # yet, since they'd hold the new ones to a smoothed version of the
+        # level below.
+        done = np.zeros(len(pixels), dtype=bool)
+        done[:y0 * width] = True
+        done[y0 * width:y0 * width + len(spilled)] = spilled
+        filled = done | old
+        wts = level_field(model, step, band_y0 * step,
+                          spill_y1 * step).reshape(-1, 4)
+        unfilled = np.flatnonzero(~filled[y0 * width:y1 * width]) + y0 * width
+        while len(unfilled):
+            starts = unfilled[rng.random(len(unfilled)) * STREAK_LENGTH < 1]
+            streaks = starts if len(starts) else unfilled
+            # after its first pixel, a streak always has the one before
+            fresh = ~in_region(streaks, done, region, width, len(window))
+            for _ in range(STREAK_LENGTH):
+                for (group, sources) in [(streaks[fresh], filled),
+                                         (streaks[~fresh], done)]:
+                    if len(group):
+                        pixels[group] = wavefront.batch_colors(
+                            group, pixels, sources, region, table, rng,
+                            width, len(window))
+                filled[streaks] = True
+                done[streaks] = True
+                # two streaks can step onto the same pixel
+                streaks = np.unique(next_pixels(streaks, filled, wts, width,
+                                                y0, spill_end, len(window),
+                                                rng))
+                fresh = np.zeros(len(streaks), dtype=bool)
+                if len(streaks) == 0:
+                    break
+            unfilled = unfilled[~filled[unfilled]]
+        # otherwise the old pixels would show as a grid of dots
+        redo = np.flatnonzero(old[y0 * width:y1 * width]) + y0 * width
+        pixels[redo] = wavefront.batch_colors(redo, pixels, done, region,
+                                              table, rng, width, len(window))
+        spilled = done[y1 * width:spill_end * width]
+
+def level_dims(width, height, coarse_size):
+    # (width, height) of each level, smallest first. Each level is the next
+    # one halved, rounding up, so level k is every 2**(last - k)-th pixel.
+    num_levels = 1
+    while max(width, height) > coarse_size * 2**(num_levels - 1):
+        num_levels += 1
+    return [(int(math.ceil(width / 2.0**k)), int(math.ceil(height / 2.0**k)))
+            for k in reversed(range(num_levels))]
+
+def coarse_model(model, step):
+    # A copy of model (sharing its trained model and rng) whose floodfill
+    # draws a small version of model's picture, one pixel for every step x
+    # step square of the canvas, using the shape wts of the square's corner
+    coarse = copy.copy(model)
+    coarse.width = int(math.ceil(model.width / float(step)))
+    coarse.height = int(math.ceil(model.height / float(step)))
+    coarse.gen_pixel_limit = coarse.width * coarse.height
+    coarse.checkpoint_path = None
+    coarse.capture_path = None
+    coarse.wts_field = level_field(model, step, 0, model.height)
+    return coarse
+
+def generate_pyramid(model, coarse_size = 512):
+    # model must already be trained. Returns the picture as an Image, and
+    # sets the same stats on the model as Model.generate.
+    dims = level_dims(model.width, model.height, coarse_size)
+    step = 2**(len(dims) - 1)
+    # the coarse level is an ordinary floodfill of a small version of model
+    coarse = coarse_model(model, step)
+    (coarse_width, coarse_height) = dims[0]
+    if model.show_progress:
+        print("Generating %dx%d coarse level..." % (coarse_width, coarse_height))
+    coarse.generate()
+    image = coarse.result_array
+
+    table = markov.batch_table([row for channel_table in model.tables
+                                for row in channel_table])
+    region = util.region_offsets(util.surrounding_region,
+                                 max(model.gen_region_size, MIN_REGION_SIZE))
+    rng = np.random.default_rng(model.rng.seed_int())
+    for (width, height) in dims[1:]:
+        step //= 2
+        if model.show_progress:
+            print("Refining to %dx%d..." % (width, height))
+        if (width, height) == (model.width, model.height):
+            # the last level goes straight into the model's result buffer
+            model.new_result_buffer()
+            finer = model.result_array
+        else:
+            finer = np.empty((height, width, 3), dtype=np.uint8)
+        finer[0::2, 0::2] = image
+        fill_level(model, finer, step, table, region, rng)
+        image = finer
+    if len(dims) == 1: # small enough to be all coarse level
+        model.new_result_buffer()
+        model.result_array[:] = image
+    model.num_seen = model.width * model.height
+    (model.num_known, model.num_seeds) = (0, coarse.num_seeds)
+    return model.result_to_image()
@@ -0,0 +1,85 @@
+# random_permutation.py - random orders of big ranges for main.py and
+# wavefront.py
+# Author: Ben Plaut
+# Contains RandomPermutation, a random order of range(n) that is computed as
+# it's needed instead of stored, so walking a random order of every pixel
+# takes no memory per pixel. Position i of the order comes from a full
+# period linear congruential generator mod the next power of two at least n,
+# scrambled with an invertible xorshift-multiply so nearby positions don't
+# give related values; values of n or more are skipped. The same n and seed
+# always give the same order, and any position can be jumped to directly,
+# so resuming only needs the position. It's not a uniformly random shuffle
+# (most orders can never come up, and the first few values aren't quite
+# independent), but it scatters the values all over the range, which is all
+# picking floodfill seeds needs.
+# Required external modules: numpy
+# Required python files: None
+
+import numpy as np
+
+BLOCK_SIZE = 1024 # how many positions block() works out at once
+
+def affine_power(a, c, k, mask):
+    # x -> a * x + c applied k times is x -> a_k * x + c_k (mod mask + 1),
+    # returns (a_k, c_k) by repeated squaring
+    (result_a, result_c) = (1, 0)
+    while k > 0:
+        if k & 1:
+            (result_a, result_c) = ((a * result_a) & mask,
+                                    (a * result_c + c) & mask)
+        (a, c) = ((a * a) & mask, (a * c + c) & mask)
+        k >>= 1
+    return (result_a, result_c)
+
+class RandomPermutation(object):
+    def __init__(self, n, seed = None):
+        self.n = n
+        self.bits = max(n - 1, 1).bit_length()
+        self.mask = 2**self.bits - 1
+        self.shift = max(self.bits // 2, 1)
+        rng = np.random.default_rng(seed)
+        draw = lambda: int(rng.integers(0, 2**62)) & self.mask
+        # a = 1 mod 4 and odd c give the generator a full period
+        self.a = (4 * draw() + 1) & self.mask
+        self.c = (2 * draw() + 1) & self.mask
+        self.start = draw()
+        self.scramble = (2 * draw() + 1) & self.mask
+        # the generator's multiplier and offset for j steps, for each j in
+        # a block, so a whole block is one numpy expression
+        steps = [affine_power(self.a, self.c, j, self.mask)
+                 for j in range(BLOCK_SIZE)]
+        self.block_a = np.array([a for (a, _) in steps], dtype=np.uint64)
+        self.block_c = np.array([c for (_, c) in steps], dtype=np.uint64)
+
+    def size(self):
+        # how many positions there are, counting the ones that are skipped
+        return self.mask + 1
+
+    def block(self, position):
+        # The values at positions position, position + 1, ... up to
+        # BLOCK_SIZE of them, as an int64 array. Skipped positions are -1.
+        (a, c) = affine_power(self.a, self.c, position, self.mask)
+        x = np.uint64((a * self.start + c) & self.mask)
+        mask = np.uint64(self.mask)
+        shift = np.uint64(self.shift)
+        # numpy's uint64 arithmetic wraps, which is fine mod a power of two
+        vals = (self.block_a * x + self.block_c) & mask
+        vals ^= vals >> shift
+        vals = (vals * np.uint64(self.scramble)) & mask
+        vals ^= vals >> shift
+        vals = vals.astype(np.int64)[:max(self.size() - position, 0)]
+        vals[vals >= self.n] = -1
+        return vals
+
+    def next_unmarked(self, position, marked):
+        # (value, position after it) for the first value at position or later
+        # where marked (an array of n bools or 0/1 bytes) is 0, or
+        # (None, size()) if there isn't one
+        while position < self.size():
+            vals = self.block(position)
+            unmarked = np.flatnonzero(vals >= 0)
+            unmarked = unmarked[marked[vals[unmarked]] == 0]
+            if len(unmarked) > 0:
+                return (int(vals[unmarked[0]]), position + int(unmarked[0]) + 1)
+            position += len(vals)
+        return (None, self.size())
@@ -0,0 +1,314 @@
+# server.py - a local render service
+# Author: Ben Plaut
+# Runs an HTTP server on localhost that renders pictures on request, so a
+# scheduler can drive RAMbrandt without starting a new process (and
+# retraining) for every picture. Trained models are kept in memory, most
+# recently used first, and pictures are generated by a pool of worker
+# processes, which also keep their shape fields and compiled models in
+# memory. Only max_queue jobs can be waiting or running at once; past that,
+# requests get a 503 right away instead of piling up.
+# Examples:
+#   python server.py --port 8080
+#   curl -d '{"shape": "circle", "training_files": ["gradient3.jpg"], "seed": 1}' localhost:8080/render > out.png
+#   curl -d '{"seed": 2, "output": "path"}' localhost:8080/render
+#   curl localhost:8080/status
+# Jobs are JSON objects; any key left out gets its value from DEFAULT_JOB.
+# Required external modules: PIL, numpy
+# Required python files: main.py, markov.py, util.py, wavefront.py,
+# pyramid.py
+
+import argparse
+import io
+import json
+import multiprocessing
+import os
+import threading
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import main
+import markov
+import util
+import wavefront
+import pyramid
+
+DEFAULT_JOB = {'shape': 'circle',
+               'training_files': ['gradient3.jpg'],
+               'palette_dir': 'input/gradients',
+               'train_region_size': 2,
+               'result_size': 500,
+               'shape_strength': 100,
+               'seed': None,
+               'mode': 'dfs', # or wavefront or pyramid, see main.py
+               'format': 'png', # or jpeg
+               'output': 'bytes'} # or path, to save under output/
+CONTENT_TYPES = {'png': 'image/png', 'jpeg': 'image/jpeg'}
+# the biggest result_size a job can ask for, so one request can't make us
+# allocate an unbounded picture
+MAX_RESULT_SIZE = 4000
+
+class LRU(object):
+    # a dict that only keeps the max_size most recently used items
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.items = OrderedDict()
+
+    def get(self, key):
+        if key not in self.items:
+            return None
+        self.items.move_to_end(key)
+        return self.items[key]
+
+    def put(self, key, val):
+        self.items[key] = val
+        self.items.move_to_end(key)
+        while len(self.items) > self.max_size:
+            self.items.popitem(last=False)
+
+# compiled models, kept by each worker between jobs. set up by init_worker
+worker_compiled = None
+
+def init_worker(max_models):
+    global worker_compiled
+    worker_compiled = LRU(max_models)
+
+def render_job(job, model_key, counts):
+    # runs in a worker, returns the picture as bytes or the path it was
+    # saved to
+    params = main.make_params(main.SHAPES[job['shape']],
+                              job['training_files'], job['train_region_size'],
+                              job['result_size'], job['shape_strength'],
+                              job['palette_dir'])
+    model = main.Model(*params, seed=job['seed'])
+    model.show_progress = False
+    compiled = worker_compiled.get(model_key)
+    if compiled is None:
+        compiled = markov.compile_counts(counts)
+        worker_compiled.put(model_key, compiled)
+    model.set_trained(counts, compiled)
+    if job['mode'] == 'wavefront':
+        image = wavefront.generate_wavefront(model)
+    elif job['mode'] == 'pyramid':
+        image = pyramid.generate_pyramid(model)
+    else:
+        image = model.generate()
+    if job['output'] == 'path':
+        (train_region_size, _, train_palette_size, gen_region_size, _,
+         shape_strength, _, shape_func, _, _, palette_files, _) = params
+        output_name = util.make_output_name(
+            shape_func, train_region_size, gen_region_size,
+            train_palette_size, palette_files, shape_strength,
+            seed=job['seed'], mode=job['mode'])
+        output_name = os.path.splitext(output_name)[0] + '.' + job['format']
+        os.makedirs(os.path.dirname(output_name), exist_ok=True)
+        image.save(output_name)
+        return os.path.abspath(output_name)
+    output = io.BytesIO()
+    image.save(output, format=job['format'].upper())
+    return output.getvalue()
+
+class RenderService(object):
+    def __init__(self, processes = None, max_queue = 16, max_models = 8,
+                 model_cache_dir = None, thumbnail_cache_dir = None,
+                 max_result_size = MAX_RESULT_SIZE):
+        self.pool = multiprocessing.Pool(processes or os.cpu_count(),
+                                         initializer=init_worker,
+                                         initargs=(max_models,))
+        self.slots = threading.BoundedSemaphore(max_queue)
+        self.max_queue = max_queue
+        self.max_result_size = max_result_size
+        self.models = LRU(max_models)
+        self.models_lock = threading.Lock() # for models and training_locks
+        # one lock per palette being trained, so each palette is trained
+        # once without holding up jobs for palettes we already have
+        self.training_locks = dict()
+        self.model_cache_dir = model_cache_dir
+        self.thumbnail_cache_dir = thumbnail_cache_dir
+        self.stats_lock = threading.Lock()
+        self.num_queued = 0
+        self.num_done = 0
+
+    def parse_job(self, request):
+        # fills in defaults and checks everything, raising ValueError with a
+        # message for the client if something is wrong
+        unknown = set(request) - set(DEFAULT_JOB)
+        if unknown:
+            raise ValueError("Unknown keys: %s" % ', '.join(sorted(unknown)))
+        job = dict(DEFAULT_JOB)
+        job.update(request)
+        if isinstance(job['training_files'], str):
+            job['training_files'] = job['training_files'].split(',')
+        if (not isinstance(job['training_files'], list)
+            or not job['training_files']
+            or not all(isinstance(filename, str)
+                       for filename in job['training_files'])):
+            raise ValueError("training_files must be a non-empty list of "
+                             "file names")
+        for name in ['shape', 'palette_dir', 'mode', 'format', 'output']:
+            if not isinstance(job[name], str):
+                raise ValueError("%s must be a string" % name)
+        if job['shape'] not in main.SHAPES:
+            raise ValueError("Unknown shape '%s'" % job['shape'])
+        # bools are ints to python, but not to JSON
+        for name in ['train_region_size', 'result_size', 'shape_strength']:
+            if (not isinstance(job[name], int) or isinstance(job[name], bool)
+                or job[name] < 1):
+                raise ValueError("%s must be a positive integer" % name)
+        if job['result_size'] > self.max_result_size:
+            raise ValueError("result_size can be at most %d" %
+                             self.max_result_size)
+        if job['seed'] is not None and (not isinstance(job['seed'], int)
+                                        or isinstance(job['seed'], bool)
+                                        or job['seed'] < 0):
+            raise ValueError("seed must be a non-negative integer")
+        if job['mode'] not in ['dfs', 'wavefront', 'pyramid']:
+            raise ValueError("mode must be dfs, wavefront or pyramid")
+        if job['format'] not in CONTENT_TYPES:
+            raise ValueError("format must be png or jpeg")
+        if job['output'] not in ['bytes', 'path']:
+            raise ValueError("output must be bytes or path")
+        # Names have to be exactly as listed, since that's how
+        # util.get_input_paths finds them (and it exits if it can't, which
+        # would take down the handler or a worker), so './x.jpg' is no good
+        if not os.path.isdir(job['palette_dir']):
+            raise ValueError("No palette directory %s" % job['palette_dir'])
+        found_files = set(os.listdir(job['palette_dir']))
+        for filename in job['training_files']:
+            if (filename not in found_files or not os.path.isfile(
+                    os.path.join(job['palette_dir'], filename))):
+                raise ValueError("No training file %s in %s" %
+                                 (filename, job['palette_dir']))
+        return job
+
+    def trained_counts(self, job):
+        key = (job['palette_dir'], tuple(job['training_files']),
+               job['train_region_size'])
+        with self.models_lock:
+            counts = self.models.get(key)
+            if counts is not None:
+                return (key, counts)
+            training_lock = self.training_locks.setdefault(key,
+                                                           threading.Lock())
+        with training_lock:
+            # another job may have trained it while we waited
+            with self.models_lock:
+                counts = self.models.get(key)
+            if counts is None:
+                params = main.make_params(
+                    main.SHAPES[job['shape']], job['training_files'],
+                    job['train_region_size'], job['result_size'], 1,
+                    job['palette_dir'])
+                model = main.Model(
+                    *params, model_cache_dir=self.model_cache_dir,
+                    thumbnail_cache_dir=self.thumbnail_cache_dir)
+                model.train_palette()
+                counts = model.counts
+                with self.models_lock:
+                    self.models.put(key, counts)
+                    self.training_locks.pop(key, None)
+        return (key, counts)
+
+    def render(self, job):
+        # Returns the result of render_job, or None if the queue is full
+        if not self.slots.acquire(blocking=False):
+            return None
+        with self.stats_lock:
+            self.num_queued += 1
+        try:
+            (key, counts) = self.trained_counts(job)
+            return self.pool.apply(render_job, (job, key, counts))
+        finally:
+            with self.stats_lock:
+                self.num_queued -= 1
+                self.num_done += 1
+            self.slots.release()
+
+    def status(self):
+        with self.stats_lock:
+            (num_queued, num_done) = (self.num_queued, self.num_done)
+        with self.models_lock:
+            keys = list(self.models.items)
+        return {'queued': num_queued,
+                'max_queue': self.max_queue,
+                'done': num_done,
+                'models': [{'palette_dir': palette_dir,
+                            'training_files': list(training_files),
+                            'train_region_size': train_region_size}
+                           for (palette_dir, training_files, train_region_size)
+                           in keys]}
+
+class RenderHandler(BaseHTTPRequestHandler):
+    # self.server.service is the RenderService
+
+    def send(self, code, body, content_type = 'application/json'):
+        if content_type == 'application/json':
+            body = json.dumps(body).encode('utf-8')
+        self.send_response(code)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == '/status':
+            self.send(200, self.server.service.status())
+        else:
+            self.send(404, {'error': "Unknown path %s" % self.path})
+
+    def do_POST(self):
+        if self.path != '/render':
+            self.send(404, {'error': "Unknown path %s" % self.path})
+            return
+        service = self.server.service
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            request = json.loads(self.rfile.read(length) or b'{}')
+            if not isinstance(request, dict):
+                raise ValueError("The job must be a JSON object")
+            job = service.parse_job(request)
+        except ValueError as e: # includes bad JSON
+            self.send(400, {'error': str(e)})
+            return
+        except Exception as e: # anything else wrong with the job
+            self.send(400, {'error': "Bad job: %r" % e})
+            return
+        try:
+            result = service.render(job)
+        except Exception as e: # a bug, but keep serving other requests
+            self.send(500, {'error': repr(e)})
+            return
+        if result is None:
+            self.send(503, {'error': "Queue is full, try again later"})
+        elif job['output'] == 'path':
+            self.send(200, {'path': result})
+        else:
+            self.send(200, result, CONTENT_TYPES[job['format']])
+
+def run_server():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--host', help="address to listen on. The default only accepts local connections", type=str, default='127.0.0.1')
+    parser.add_argument('--port', help="port to listen on", type=int, default=8080)
+    parser.add_argument('--processes', '-p', help="number of worker processes. Defaults to the number of cores", type=int, default=None)
+    parser.add_argument('--max_queue', help="how many jobs can be waiting or running at once", type=int, default=16)
+    parser.add_argument('--max_result_size', help="the biggest result_size a job can ask for", type=int, default=MAX_RESULT_SIZE)
+    parser.add_argument('--max_models', help="how many trained models to keep in memory", type=int, default=8)
+    parser.add_argument('--model_cache_dir', help="directory for caching trained models between runs, 'none' to disable", type=str, default='cache/models')
+    parser.add_argument('--thumbnail_cache_dir', help="directory for caching resized training images between runs, 'none' to disable", type=str, default='cache/thumbnails')
+    args = parser.parse_args()
+    service = RenderService(
+        args.processes, args.max_queue, args.max_models,
+        None if args.model_cache_dir == 'none' else args.model_cache_dir,
+        None if args.thumbnail_cache_dir == 'none' else args.thumbnail_cache_dir,
+        args.max_result_size)
+    server = ThreadingHTTPServer((args.host, args.port), RenderHandler)
+    server.service = service
+    print("Listening on http://%s:%d" % (args.host, args.port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.pool.terminate()
+
+if __name__ == "__main__":
+    run_server()
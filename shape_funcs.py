@@ -4,13 +4,16 @@
 # when choosing which neighbor to floodfill next (in main.py). For example,
 # if you always weight going right really high, you'll get horizontal
 # "brushstrokes". You can also make other shapes, like cirlces, etc.
-# Required external modules: None
-# Required python files: None
+# Most shapes also have a vectorized _field version that computes the wts for
+# every pixel at once; see shape_field.
+# Required external modules: numpy, matplotlib (for visualize_vector_field)
+# Required python files: cache.py
 
 import math
-import matplotlib
-matplotlib.use("TkAgg") # without this, matplotlib and Tk conflict
-import matplotlib.pyplot as plt
+import os
+from collections import OrderedDict
+import numpy as np
+import cache
 
 def uniform(x,y,width,height, shape_strength_x, shape_strength_y):
     return format_result(1,1)
@@ -52,22 +55,59 @@ def format_result(x_comp, y_comp, num_wts = 4, default_wt = 1):
         result[1] = abs(y_comp)
     return result
 
-def visualize_vector_field(shape_func, w, h, shape_strength_x, shape_strength_y):
-    # for now, ignore sign
-    vector_field_x = [[None] * w for _ in range(h)]
-    vector_field_y = [[None] * w for _ in range(h)]   
-    for x in range(w):
-        for y in range(h):
-            wts = shape_func(x, y, w, h, shape_strength_x, shape_strength_y)
-            # order of wts is: increase x, increase y, decrease y, decrease x            
-            vector_field_x[y][x] = max(wts[0], wts[3])
-            vector_field_y[y][x] = max(wts[1], wts[2])
-    fig, (ax1, ax2) = plt.subplots(1,2)
+def draw_vector_field(fig, field, w, h, num_arrows = 20):
+    # Draws the x and y components (ignoring sign) and a quiver plot of the
+    # direction of field, which is compute_field for a w x h canvas,
+    # possibly with a step
+    extent = (0, w, h, 0) # so the axes are in canvas pixels either way
+    (ax1, ax2, ax3) = fig.subplots(1, 3)
     fig.suptitle('Vector field for chosen shape')
-    ax1.imshow(vector_field_x, cmap='gray')
+    # order of wts is: increase x, increase y, decrease y, decrease x
+    dx = field[:, :, 0] - field[:, :, 3]
+    dy = field[:, :, 1] - field[:, :, 2] # y is down on the canvas and plot
+    ax1.imshow(np.maximum(field[:, :, 0], field[:, :, 3]), cmap='gray',
+               extent=extent)
     ax1.set_title('x component')
-    ax2.imshow(vector_field_y, cmap='gray')   
-    ax2.set_title('y component')          
+    ax2.imshow(np.maximum(field[:, :, 1], field[:, :, 2]), cmap='gray',
+               extent=extent)
+    ax2.set_title('y component')
+    ax3.imshow(np.hypot(dx, dy), cmap='gray', extent=extent)
+    # about num_arrows arrows across, each in the middle of its block
+    (rows, cols) = dx.shape
+    stride = max(1, max(rows, cols) // num_arrows)
+    (dx, dy) = (dx[stride // 2::stride, stride // 2::stride],
+                dy[stride // 2::stride, stride // 2::stride])
+    xs = (np.arange(stride // 2, cols, stride) + 0.5) * w / float(cols)
+    ys = (np.arange(stride // 2, rows, stride) + 0.5) * h / float(rows)
+    length = np.hypot(dx, dy)
+    length[length == 0] = 1
+    # unit arrows, each about as long as the gap between them
+    ax3.quiver(xs, ys, dx / length, dy / length, color='red', angles='xy',
+               pivot='middle', scale=1.25 * max(len(xs), len(ys)),
+               width=0.005)
+    ax3.set_title('direction')
+
+def visualize_vector_field(shape_func, w, h, shape_strength_x, shape_strength_y,
+                           output_path = None, max_image_size = 800):
+    # Shows the vector field in a window, or with output_path, writes it to
+    # that file instead, which doesn't need a display. Big canvases are only
+    # evaluated every few pixels, since a plot can't show more detail than
+    # max_image_size anyway.
+    step = max(1, int(math.ceil(max(w, h) / float(max_image_size))))
+    field = compute_field(shape_func, w, h, shape_strength_x,
+                          shape_strength_y, step)
+    # matplotlib is slow to import, so only load it here
+    if output_path is not None:
+        from matplotlib.figure import Figure # no GUI backend needed
+        fig = Figure(figsize=(15, 5))
+        draw_vector_field(fig, field, w, h)
+        fig.savefig(output_path)
+        return
+    import matplotlib
+    matplotlib.use("TkAgg") # without this, matplotlib and Tk conflict
+    import matplotlib.pyplot as plt
+    fig = plt.figure(figsize=(15, 5))
+    draw_vector_field(fig, field, w, h)
     plt.show()
 
 def normalize(x_comp, y_comp, shape_strength_x, shape_strength_y):
@@ -202,4 +242,177 @@ def trying_random_things(x,y,w,h, shape_strength_x, shape_strength_y):
     y_comp = 1
     (x_comp, y_comp) = normalize(x_comp, y_comp, shape_strength_x, shape_strength_y)
     return format_result(x_comp, y_comp)
-    
+
+
+# Vectorized versions of the shape functions. x and y are arrays of canvas
+# coordinates (they just need to broadcast together), and the result has one
+# more axis of length 4 for the wts, in the same order as format_result.
+# These must agree with the scalar versions above.
+
+def theta_field(x, y, width, height):
+    adjusted_x = x - width/2
+    adjusted_y = height/2 - y
+    with np.errstate(divide='ignore', invalid='ignore'):
+        arctan = np.arctan(adjusted_y / adjusted_x)
+    result = np.where(adjusted_x < 0, math.pi + arctan, arctan)
+    # same special case as theta when x is exactly in the middle
+    middle = np.where(y < height/2, math.pi/2, -math.pi/2)
+    return np.where(x == width/2, middle, result)
+
+def format_result_field(x_comp, y_comp, default_wt = 1):
+    (x_comp, y_comp) = np.broadcast_arrays(x_comp, y_comp)
+    result = np.empty(x_comp.shape + (4,))
+    result[..., 0] = np.where(x_comp >= 0, x_comp, default_wt)
+    result[..., 3] = np.where(x_comp < 0, np.abs(x_comp), default_wt)
+    result[..., 2] = np.where(y_comp >= 0, y_comp, default_wt)
+    result[..., 1] = np.where(y_comp < 0, np.abs(y_comp), default_wt)
+    return result
+
+def normalize_field(x_comp, y_comp, shape_strength_x, shape_strength_y):
+    (x_comp, y_comp) = np.broadcast_arrays(x_comp, y_comp)
+    both_zero = (x_comp == 0) & (y_comp == 0)
+    x_comp = np.where(both_zero, 1, x_comp)
+    y_comp = np.where(both_zero, 1, y_comp)
+    magnitude = np.sqrt(x_comp**2 + y_comp**2)
+    x_comp = x_comp / magnitude * shape_strength_x
+    y_comp = y_comp / magnitude * shape_strength_y
+    return (x_comp, y_comp)
+
+def uniform_field(x, y, w, h, shape_strength_x, shape_strength_y):
+    (x, y) = np.broadcast_arrays(x, y)
+    return format_result_field(np.ones(x.shape), np.ones(y.shape))
+
+def cosine_field(x, y, w, h, shape_strength_x, shape_strength_y):
+    period = w / 2
+    adjusted_x = 2 * math.pi * x / period
+    slope = -np.sin(adjusted_x)
+    with np.errstate(divide='ignore'):
+        x_comp = np.where(np.abs(slope) < 0.0001, shape_strength_x,
+                          np.abs(1 / slope) * shape_strength_x)
+    y_comp = slope * shape_strength_y
+    return format_result_field(x_comp, y_comp)
+
+def parabola_field(x, y, w, h, shape_strength_x, shape_strength_y):
+    x = x - w/2
+    x_comp = np.full(np.shape(x), float(shape_strength_x))
+    y_comp = shape_strength_y * 2*x
+    (x_comp, y_comp) = normalize_field(x_comp, y_comp, shape_strength_x,
+                                       shape_strength_y)
+    return format_result_field(x_comp, y_comp)
+
+def circle_field(x, y, w, h, shape_strength_x, shape_strength_y):
+    curr_theta = theta_field(x, y, w, h)
+    x_component = shape_strength_x * (-np.sin(curr_theta))
+    y_component = shape_strength_y * np.cos(curr_theta)
+    return format_result_field(x_component, y_component)
+
+def double_circle_field(x, y, w, h, shape_strength_x, shape_strength_y):
+    x = np.where(x > w/2, x - w/2, x)
+    return circle_field(x, y, w/2, h, shape_strength_x, shape_strength_y)
+
+def four_circles_field(x, y, w, h, shape_strength_x, shape_strength_y):
+    (x, y) = np.broadcast_arrays(x, y)
+    # same quadrant logic as four_circles, including its use of w for y
+    lower_right = (x > w/2) & (y > w/2)
+    lower_left = ~lower_right & (x < w/2) & (y > h/2)
+    upper_right = ~lower_right & ~lower_left & (x > w/2) & (y < h/2)
+    x = np.where(lower_right | upper_right, x - w/2, x)
+    y = np.where(lower_right | lower_left, y - h/2, y)
+    return circle_field(x, y, w/2, h/2, shape_strength_x, shape_strength_y)
+
+def heart_field(x, y, w, h, shape_strength_x, shape_strength_y):
+    adjusted_theta = math.pi/2 - theta_field(x, y, w, h)
+    x_comp = 48*np.cos(adjusted_theta)*((np.sin(adjusted_theta))**2)
+    y_comp = (-13*np.cos(adjusted_theta) + 10*np.cos(2*adjusted_theta)
+              + 6*np.cos(3*adjusted_theta) +4*np.cos(4*adjusted_theta))
+    (x_comp, y_comp) = normalize_field(x_comp, y_comp, shape_strength_x,
+                                       shape_strength_y)
+    flip = ((x > w/2) & (y > h/2)) | ((x < w/2) & (y < h/2))
+    y_comp = np.where(flip, -y_comp, y_comp)
+    return format_result_field(x_comp, y_comp)
+
+def squiggles_field(x, y, w, h, shape_strength_x, shape_strength_y):
+    adjusted_x = 4 * x / w - 2
+    adjusted_y = 4 * y / h - 2
+    x_comp = shape_strength_x * np.sin(adjusted_x + adjusted_y)
+    y_comp = shape_strength_y * np.cos(adjusted_x - adjusted_y)
+    return format_result_field(x_comp, y_comp)
+
+def outward_field(x, y, w, h, shape_strength_x, shape_strength_y):
+    x_comp = shape_strength_x * (x - w/2) / (w/2)
+    y_comp = shape_strength_y * (h/2 - y) / (h/2)
+    return format_result_field(x_comp, y_comp)
+
+def weird_circle_field(x, y, w, h, shape_strength_x, shape_strength_y):
+    curr_theta = theta_field(x, y, w, h)
+    x_comp = -np.sin(curr_theta) + .7
+    y_comp = np.cos(curr_theta)
+    (x_comp, y_comp) = normalize_field(x_comp, y_comp, shape_strength_x,
+                                       shape_strength_y)
+    return format_result_field(x_comp, y_comp)
+
+FIELD_FUNCS = {uniform: uniform_field, cosine: cosine_field,
+               parabola: parabola_field, circle: circle_field,
+               double_circle: double_circle_field,
+               four_circles: four_circles_field, heart: heart_field,
+               squiggles: squiggles_field, outward: outward_field,
+               weird_circle: weird_circle_field}
+
+def compute_field(shape_func, w, h, shape_strength_x, shape_strength_y,
+                  step = 1, y0 = 0, y1 = None):
+    # With step > 1, only every step-th pixel in each direction (for
+    # previews and coarse versions of big canvases). y0 and y1 limit it to
+    # rows y0 <= y < y1 of the canvas, so big fields can be done in bands.
+    x = np.arange(0, w, step, dtype=np.float64)[np.newaxis, :]
+    y = np.arange(y0, h if y1 is None else min(y1, h), step,
+                  dtype=np.float64)[:, np.newaxis]
+    if shape_func in FIELD_FUNCS:
+        field = FIELD_FUNCS[shape_func](x, y, w, h, shape_strength_x,
+                                        shape_strength_y)
+    else: # no vectorized version, so call the shape func for every pixel
+        field = np.array([[shape_func(x, y, w, h, shape_strength_x,
+                                      shape_strength_y)
+                           for x in range(0, w, step)]
+                          for y in range(y0, h if y1 is None else min(y1, h),
+                                         step)], dtype=np.float64)
+    # some shapes only depend on x, so broadcast up to the whole canvas
+    return np.broadcast_to(field, (y.shape[0], x.shape[1], 4)).astype(
+        np.float32)
+
+# Fields we've already computed, most recently used last. Big canvases have
+# big fields, so we only keep up to field_cache_bytes of them in memory.
+field_cache = OrderedDict()
+field_cache_bytes = 2**30
+
+def field_cache_path(cache_dir, key):
+    return os.path.join(cache_dir, '%s_w=%d_h=%d_sx=%s_sy=%s.npy' % key)
+
+def shape_field(shape_func, w, h, shape_strength_x, shape_strength_y,
+                cache_dir = None):
+    # Returns a (h, w, 4) float32 array where field[y, x] is
+    # shape_func(x, y, w, h, shape_strength_x, shape_strength_y). Fields are
+    # cached in memory, and also on disk in cache_dir if it is given, so
+    # repeated renders at the same size skip the shape math.
+    key = (shape_func.__name__, w, h, shape_strength_x, shape_strength_y)
+    if key in field_cache:
+        field_cache.move_to_end(key)
+        return field_cache[key]
+    path = None if cache_dir is None else field_cache_path(cache_dir, key)
+    if path is not None and os.path.exists(path):
+        field = np.load(path)
+        cache.touch(path)
+    else:
+        field = compute_field(shape_func, w, h, shape_strength_x,
+                              shape_strength_y)
+        if path is not None:
+            os.makedirs(cache_dir, exist_ok=True)
+            tmp_path = path + '.%d.tmp' % os.getpid()
+            with open(tmp_path, 'wb') as f:
+                np.save(f, field)
+            os.replace(tmp_path, path)
+            cache.evict(cache_dir)
+    field_cache[key] = field
+    while (sum(cached.nbytes for cached in field_cache.values())
+           > field_cache_bytes and len(field_cache) > 1):
+        field_cache.popitem(last=False)
+    return field
@@ -0,0 +1,214 @@
+# tiling.py - generates one big picture on several cores
+# Author: Ben Plaut
+# Splits the canvas into square tiles and generates them in worker processes
+# with the same trained model and shape field. Tiles are done in 4 phases, by
+# (column parity, row parity), so no two neighboring tiles are ever generated
+# at the same time. Each tile is generated overlap pixels past its edges, so
+# every seam is a strip 2 * overlap wide that is generated twice, once by
+# each tile. The second tile conditions on a margin of the first one's pixels
+# just outside the strip (which it doesn't change), so it starts out with the
+# same colors, and the two versions of the strip are blended with weights
+# that go linearly from one tile to the other across it. That way strokes
+# fade across the seams instead of stopping at them.
+# A tile's floodfill can't see the shape of the whole picture (like the rings
+# of the circle shape), so first we floodfill a guide: the whole picture at
+# half size or less (see pyramid.coarse_model). Each tile then also
+# conditions on a sparse grid of the guide's colors, every GUIDE_SPACING
+# pixels, and those grid pixels are replaced by the average of their
+# neighbors once the tile is done, so the grid doesn't show.
+# Required external modules: PIL, numpy
+# Required python files: main.py, pyramid.py
+
+import multiprocessing
+import os
+import numpy as np
+from PIL import Image
+import pyramid
+
+# order in which the tiles are generated, by (column % 2, row % 2)
+PHASES = [(0, 0), (1, 0), (0, 1), (1, 1)]
+# pixels between the guide pixels each tile conditions on
+GUIDE_SPACING = 8
+# the guide is at most this big on a side (and at most half size), so it's
+# a small part of the work
+GUIDE_MAX_SIZE = 1024
+
+worker_model = None # set up in each worker by init_worker
+
+def init_worker(model):
+    global worker_model
+    worker_model = model
+
+def generate_tile(job):
+    (x0, y0, known_pixels, known_mask, guide_mask, seed) = job
+    (height, width, _) = known_pixels.shape
+    model = worker_model.window(x0, y0, width, height)
+    model.set_seed(seed)
+    model.generate(known_pixels, known_mask)
+    result = model.result_array.copy()
+    # The guide pixels were only there to condition on, so replace them with
+    # the average of their 4 neighbors. They're never on the window's edge
+    # or next to each other, see guide_pixels.
+    (ys, xs) = np.nonzero(np.frombuffer(guide_mask, dtype=np.uint8).reshape(
+        height, width))
+    neighbors = (result[ys - 1, xs].astype(np.intp) + result[ys + 1, xs]
+                 + result[ys, xs - 1] + result[ys, xs + 1])
+    result[ys, xs] = (neighbors + 2) // 4
+    return result
+
+def tile_grid(width, height, tile_size):
+    # (column, row, x0, y0, x1, y1) for each tile, x1 and y1 exclusive
+    return [(col, row, x0, y0, min(x0 + tile_size, width),
+             min(y0 + tile_size, height))
+            for (row, y0) in enumerate(range(0, height, tile_size))
+            for (col, x0) in enumerate(range(0, width, tile_size))]
+
+def ramp(lo, hi, overlap, size):
+    # A tile covering [lo, hi) of an axis of length size is generated on
+    # [start, stop) = [lo - overlap, hi + overlap), cut to the canvas.
+    # Returns that and each coordinate's blend weight, which goes linearly
+    # from 0 to 1 across the 2 * overlap pixels around each inner edge, so
+    # the weights of two neighboring tiles always add up to 1.
+    (start, stop) = (max(lo - overlap, 0), min(hi + overlap, size))
+    coords = np.arange(start, stop) + 0.5
+    wts = np.ones(stop - start)
+    if overlap > 0 and lo > 0:
+        wts = np.minimum(wts, (coords - (lo - overlap)) / (2 * overlap))
+    if overlap > 0 and hi < size:
+        wts = np.minimum(wts, (hi + overlap - coords) / (2 * overlap))
+    return (start, stop, wts)
+
+def tile_weights(tile, overlap, width, height):
+    # (x0, y0, x1, y1) of the part of the canvas the tile is generated on,
+    # and the (y1 - y0, x1 - x0) blend weights there
+    (_, _, tile_x0, tile_y0, tile_x1, tile_y1) = tile
+    (x0, x1, x_wts) = ramp(tile_x0, tile_x1, overlap, width)
+    (y0, y1, y_wts) = ramp(tile_y0, tile_y1, overlap, height)
+    return ((x0, y0, x1, y1), y_wts[:, np.newaxis] * x_wts[np.newaxis, :])
+
+def done_weight(window, done, overlap, width, height):
+    # how much of each pixel in window = (x0, y0, x1, y1) the done tiles
+    # have blended in so far: 1 when it's finished, 0 when nothing is there
+    (x0, y0, x1, y1) = window
+    total = np.zeros((y1 - y0, x1 - x0))
+    for tile in done:
+        ((tx0, ty0, tx1, ty1), wts) = tile_weights(tile, overlap, width,
+                                                   height)
+        (ix0, iy0) = (max(x0, tx0), max(y0, ty0))
+        (ix1, iy1) = (min(x1, tx1), min(y1, ty1))
+        if ix0 < ix1 and iy0 < iy1:
+            total[iy0 - y0:iy1 - y0, ix0 - x0:ix1 - x0] += \
+                wts[iy0 - ty0:iy1 - ty0, ix0 - tx0:ix1 - tx0]
+    return total
+
+def make_guide(model):
+    # (guide picture as a (height, width, 3) array, canvas pixels per guide
+    # pixel), or None if the picture is too small to need one
+    step = 2
+    while max(model.width, model.height) > GUIDE_MAX_SIZE * step:
+        step *= 2
+    if min(model.width, model.height) < GUIDE_SPACING * step:
+        return None
+    coarse = pyramid.coarse_model(model, step)
+    coarse.show_progress = False
+    print("Generating %dx%d guide..." % (coarse.width, coarse.height))
+    coarse.generate()
+    return (coarse.result_array.copy(), step)
+
+def guide_pixels(guide, x0, y0, x1, y1, known_mask):
+    # (mask, colors) of the guide pixels for the window (x0, y0, x1, y1):
+    # every GUIDE_SPACING-th pixel of the canvas in each direction, except
+    # the ones that are already known or on the window's edge
+    (guide_array, step) = guide
+    mask = np.zeros((y1 - y0, x1 - x0), dtype=bool)
+    first = GUIDE_SPACING // 2
+    ys = np.arange(y0 + (first - y0) % GUIDE_SPACING, y1, GUIDE_SPACING)
+    xs = np.arange(x0 + (first - x0) % GUIDE_SPACING, x1, GUIDE_SPACING)
+    mask[np.ix_(ys - y0, xs - x0)] = True
+    mask[[0, -1], :] = False
+    mask[:, [0, -1]] = False
+    mask &= ~known_mask
+    colors = guide_array[np.ix_(ys // step, xs // step)]
+    grid = np.zeros((y1 - y0, x1 - x0, 3), dtype=np.uint8)
+    grid[np.ix_(ys - y0, xs - x0)] = colors
+    return (mask, grid)
+
+def make_job(tile, done, margin, overlap, canvas, guide, rng):
+    (height, width, _) = canvas.shape
+    (col, row) = tile[:2]
+    ((gen_x0, gen_y0, gen_x1, gen_y1), _) = tile_weights(tile, overlap,
+                                                         width, height)
+    # Grow the window by margin on each side where the neighboring tile is
+    # already done, to condition on it. Because of the phase order, whenever
+    # two sides are grown the diagonal tile in that corner is done too.
+    done_cells = set((tile[0], tile[1]) for tile in done)
+    (x0, y0, x1, y1) = (gen_x0, gen_y0, gen_x1, gen_y1)
+    if (col - 1, row) in done_cells: x0 = max(x0 - margin, 0)
+    if (col + 1, row) in done_cells: x1 = min(x1 + margin, width)
+    if (col, row - 1) in done_cells: y0 = max(y0 - margin, 0)
+    if (col, row + 1) in done_cells: y1 = min(y1 + margin, height)
+    known_pixels = canvas[y0:y1, x0:x1].copy()
+    # we condition on whatever the done tiles have drawn outside the part
+    # we generate, and generate the rest
+    known_mask = done_weight((x0, y0, x1, y1), done, overlap, width,
+                             height) > 0
+    known_mask[gen_y0 - y0:gen_y1 - y0, gen_x0 - x0:gen_x1 - x0] = False
+    guide_mask = np.zeros_like(known_mask)
+    if guide is not None:
+        (guide_mask, grid) = guide_pixels(guide, x0, y0, x1, y1, known_mask)
+        known_pixels[guide_mask] = grid[guide_mask]
+        known_mask |= guide_mask
+    return (x0, y0, known_pixels, known_mask.astype(np.uint8).tobytes(),
+            guide_mask.astype(np.uint8).tobytes(), rng.seed_int())
+
+def blend_tile(canvas, tile, result, result_x0, result_y0, done, overlap):
+    # Blends the part of result (a window with upper left corner
+    # (result_x0, result_y0)) that tile was generated on into canvas, as a
+    # running weighted average with what the done tiles put there
+    (height, width, _) = canvas.shape
+    ((x0, y0, x1, y1), wts) = tile_weights(tile, overlap, width, height)
+    new = result[y0 - result_y0:y1 - result_y0,
+                 x0 - result_x0:x1 - result_x0].astype(np.float64)
+    total = done_weight((x0, y0, x1, y1), done, overlap, width, height) + wts
+    share = (wts / total)[:, :, np.newaxis]
+    old = canvas[y0:y1, x0:x1].astype(np.float64)
+    canvas[y0:y1, x0:x1] = np.rint(old + share * (new - old)).astype(np.uint8)
+
+def generate_tiled(model, tile_size, processes = None, margin = None,
+                   overlap = None, use_guide = True):
+    # model must already be trained. margin defaults to how far generation
+    # looks for neighbors, which is all a tile can see of its neighbors.
+    # overlap defaults to an eighth of tile_size, and it can't be so big that
+    # tiles in the same phase would overlap.
+    (width, height) = (model.width, model.height)
+    if margin is None:
+        margin = model.gen_region_size
+    if overlap is None:
+        overlap = tile_size // 8
+    overlap = max(min(overlap, (tile_size - margin) // 2), 0)
+    if model.wts_field is None:
+        model.load_shape_field()
+    guide = make_guide(model) if use_guide else None
+    canvas = np.zeros((height, width, 3), dtype=np.uint8)
+    tiles = tile_grid(width, height, tile_size)
+    done = []
+    with multiprocessing.Pool(processes or os.cpu_count(),
+                              initializer=init_worker,
+                              initargs=(model,)) as pool:
+        for (col_parity, row_parity) in PHASES:
+            phase_tiles = [tile for tile in tiles
+                           if (tile[0] % 2, tile[1] % 2) == (col_parity,
+                                                             row_parity)]
+            # seeds are drawn here, in tile order, so the result only
+            # depends on the random seed and not on the number of processes
+            jobs = [make_job(tile, done, margin, overlap, canvas, guide,
+                             model.rng)
+                    for tile in phase_tiles]
+            results = pool.map(generate_tile, jobs)
+            for (tile, job, result) in zip(phase_tiles, jobs, results):
+                (x0, y0, _, _, _, _) = job
+                blend_tile(canvas, tile, result, x0, y0, done, overlap)
+                done.append(tile)
+            print("Finished tile phase %d of %d" %
+                  (PHASES.index((col_parity, row_parity)) + 1, len(PHASES)))
+    return Image.fromarray(canvas)
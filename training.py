@@ -0,0 +1,143 @@
+# training.py - parallel and incremental training for main.py
+# Author: Ben Plaut
+# Contains helper functions for training on many images at once. The images
+# are split into chunks, each worker process counts the transitions in its
+# chunk, and the partial counts are added up, which gives exactly the same
+# model as training on the images one by one. A model file (a "library")
+# remembers which images it has been trained on, so new images can be added
+# to it later without going through the old ones again. Resized training
+# images can be kept in a thumbnail cache, so images we've trained on before
+# don't need to be decoded again.
+# Required external modules: PIL, numpy
+# Required python files: markov.py, util.py, cache.py
+
+import multiprocessing
+import os
+import numpy as np
+from PIL import Image
+import markov
+import util
+import cache
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.gif', '.tif', '.tiff')
+# fewer images than this aren't worth starting worker processes for
+MIN_PARALLEL_IMAGES = 8
+
+def list_images(image_dir):
+    # every image file in image_dir, sorted so runs are repeatable
+    return sorted(name for name in os.listdir(image_dir)
+                  if name.lower().endswith(IMAGE_EXTENSIONS))
+
+def image_pixels(image, train_palette_size):
+    # want to resize so that dimension ratio is maintained, but the
+    # number of pixels is now train_palette_size
+    image = util.resize_intelligently(image, train_palette_size)
+    return np.asarray(image.convert('RGB'))
+
+def load_pixels(image_path, train_palette_size, thumbnail_cache_dir = None):
+    # image_pixels for the image at image_path, from the thumbnail cache if
+    # we've resized the same image to the same size before
+    if thumbnail_cache_dir is not None:
+        key = cache.thumbnail_key(cache.hash_file(image_path),
+                                  train_palette_size)
+        pixels = cache.load_thumbnail(thumbnail_cache_dir, key)
+        if pixels is not None:
+            return pixels
+    with Image.open(image_path) as image:
+        pixels = image_pixels(image, train_palette_size)
+    if thumbnail_cache_dir is not None:
+        cache.save_thumbnail(thumbnail_cache_dir, key, pixels)
+    return pixels
+
+def count_image(image, train_palette_size, offsets, counts):
+    # Do the markov-chain-style conditioning for every pixel at once
+    markov.count_transitions(image_pixels(image, train_palette_size),
+                             offsets, counts)
+
+def count_chunk(job):
+    # runs in a worker, returns the counts for one chunk of images
+    (image_paths, train_palette_size, offsets, thumbnail_cache_dir) = job
+    counts = markov.new_counts()
+    for image_path in image_paths:
+        pixels = load_pixels(image_path, train_palette_size,
+                             thumbnail_cache_dir)
+        markov.count_transitions(pixels, offsets, counts)
+    return counts
+
+def train_counts(image_paths, train_palette_size, offsets, processes = None,
+                 thumbnail_cache_dir = None):
+    # The transition counts for all of image_paths. With more than a few
+    # images they are spread over processes (default: one per core).
+    processes = min(processes or os.cpu_count(), len(image_paths))
+    if processes <= 1 or len(image_paths) < MIN_PARALLEL_IMAGES:
+        counts = count_chunk((image_paths, train_palette_size, offsets,
+                              thumbnail_cache_dir))
+    else:
+        # a few chunks per process, so one slow chunk doesn't hold everyone up
+        num_chunks = min(4 * processes, len(image_paths))
+        jobs = [(image_paths[i::num_chunks], train_palette_size, offsets,
+                 thumbnail_cache_dir) for i in range(num_chunks)]
+        counts = markov.new_counts()
+        with multiprocessing.Pool(processes) as pool:
+            for partial in pool.imap_unordered(count_chunk, jobs):
+                counts += partial
+    if thumbnail_cache_dir is not None:
+        cache.evict(thumbnail_cache_dir)
+    return counts
+
+def load_library(path):
+    # returns (counts, image hashes, training settings), or None if there
+    # is no library at path yet
+    if not os.path.exists(path):
+        return None
+    with np.load(path) as data:
+        counts = data['counts'].astype(np.uint32)
+        hashes = set(data['hashes'].tolist())
+        settings = (int(data['train_region_size']),
+                    int(data['train_palette_size']),
+                    [tuple(offset) for offset in data['offsets'].tolist()])
+    return (counts, hashes, settings)
+
+def save_library(path, counts, hashes, settings):
+    (train_region_size, train_palette_size, offsets) = settings
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    # write to a temp file first, so an interruption never loses the library
+    tmp_path = path + '.%d.tmp' % os.getpid()
+    with open(tmp_path, 'wb') as f:
+        np.savez_compressed(f, counts=counts,
+                            hashes=np.array(sorted(hashes), dtype=str),
+                            train_region_size=train_region_size,
+                            train_palette_size=train_palette_size,
+                            offsets=np.array(offsets, dtype=np.int64))
+    os.replace(tmp_path, path)
+
+def update_library(path, image_paths, train_region_size, train_palette_size,
+                   offsets, processes = None, thumbnail_cache_dir = None):
+    # Adds the images in image_paths that the library at path hasn't seen
+    # (by content, not by name) to it, creating it if needed. Returns the
+    # counts for everything the library has been trained on.
+    settings = (train_region_size, train_palette_size, list(offsets))
+    library = load_library(path)
+    if library is None:
+        (counts, hashes) = (markov.new_counts(), set())
+    else:
+        (counts, hashes, library_settings) = library
+        if library_settings != settings:
+            raise ValueError("%s was trained with different settings "
+                             "(train_region_size=%d, train_palette_size=%d)" %
+                             ((path,) + library_settings[:2]))
+    new_paths = []
+    for image_path in image_paths:
+        file_hash = cache.hash_file(image_path)
+        if file_hash not in hashes:
+            hashes.add(file_hash)
+            new_paths.append(image_path)
+    print("Model file %s: %d new images, %d already trained" %
+          (path, len(new_paths), len(image_paths) - len(new_paths)))
+    if new_paths:
+        counts += train_counts(new_paths, train_palette_size, offsets,
+                               processes, thumbnail_cache_dir)
+        save_library(path, counts, hashes, settings)
+    return counts
@@ -1,28 +1,17 @@
 # util.py - helper functions for art.py
 # Author: Ben Plaut
 # Contains helper functions for main.py
-# Required external modules: PIL
+# Required external modules: PIL, numpy
 # Required python files: None
 
-from tkinter import *
-from PIL import Image, ImageTk
+from PIL import Image
 import random
+import numpy as np
 import copy
+import functools
 import math
 import os
 import sys
-import threading
-
-def call_with_large_stack(f,*args):
-    threading.stack_size(2**27)  # 64MB stack
-    sys.setrecursionlimit(2**27) # will hit 64MB stack limit first
-    # need new thread to get the redefined stack size
-    def wrapped_fn(result_wrapper): result_wrapper[0] = f(*args)
-    result_wrapper = [None]
-    thread = threading.Thread(target=wrapped_fn, args=[result_wrapper])
-    thread.start()
-    thread.join()
-    return result_wrapper[0]
 
 def weighted_random_index(L, wts):
     rand_float = random.random() # between 0.0 and 1.0
@@ -44,6 +33,27 @@ def weighted_random_shuffle(L, wts):
         wts.pop(rand_index)
     return result
  
+def weighted_random_shuffle4(L, wts, rand = random.random):
+    # Same distribution as weighted_random_shuffle, specialized for the 4
+    # floodfill directions: each step picks one of the remaining items with
+    # probability proportional to its wt, but in place and without re-summing
+    # the wts, so it is always exactly 3 random draws (from rand).
+    L = list(L)
+    wts = list(wts)
+    total = wts[0] + wts[1] + wts[2] + wts[3]
+    for i in range(3):
+        rand_float = rand() * total
+        j = i
+        wt_sum = wts[i]
+        while rand_float >= wt_sum and j < 3:
+            j += 1
+            wt_sum += wts[j]
+        # move the chosen item to position i, the rest stay in play
+        (L[i], L[j]) = (L[j], L[i])
+        (wts[i], wts[j]) = (wts[j], wts[i])
+        total -= wts[i]
+    return L
+
 def append_to_dict(d, key, val):
     if key in d:
         d[key].append(val)
@@ -60,29 +70,53 @@ def closest_val_in_dict(d, key):
     else:
         return upper
  
-def upper_left_region(x, y, n):
+# The regions are built once per size as (dx, dy) offsets, and the region
+# funcs just add them to (x, y)
+@functools.lru_cache(maxsize=None)
+def upper_left_offsets(n):
     result = []
     for i in range(0, n + 1): # we want to include (x - n, y) so n + 1
         for j in range(0, n + 1):
             if 1 <= i + j <= n:
-                result.append((x - i, y - j))
-    return result
- 
-def lower_right_region(x, y, n):
+                result.append((-i, -j))
+    return tuple(result)
+
+@functools.lru_cache(maxsize=None)
+def lower_right_offsets(n):
     result = []
     for i in range(0, n + 1): # we want to include (x - n, y) so n + 1
         for j in range(0, n + 1):
             if 1 <= i + j <= n:
-                result.append((x + i, y + j))
-    return result
- 
-def surrounding_region(x, y, n):
+                result.append((i, j))
+    return tuple(result)
+
+@functools.lru_cache(maxsize=None)
+def surrounding_offsets(n):
     result = []
     for i in range(-n, n + 1): # we want to include (x - n, y) so n + 1
         for j in range(-n, n + 1):
             if 1 <= abs(i) + abs(j) <= n:
-                result.append((x - i, y - j))
-    return result
+                result.append((-i, -j))
+    return tuple(result)
+
+def upper_left_region(x, y, n):
+    return [(x + dx, y + dy) for (dx, dy) in upper_left_offsets(n)]
+ 
+def lower_right_region(x, y, n):
+    return [(x + dx, y + dy) for (dx, dy) in lower_right_offsets(n)]
+ 
+def surrounding_region(x, y, n):
+    return [(x + dx, y + dy) for (dx, dy) in surrounding_offsets(n)]
+
+REGION_OFFSETS = {upper_left_region: upper_left_offsets,
+                  lower_right_region: lower_right_offsets,
+                  surrounding_region: surrounding_offsets}
+
+def region_offsets(region_func, n):
+    # the (dx, dy) offsets of region_func's region of size n
+    if region_func in REGION_OFFSETS:
+        return REGION_OFFSETS[region_func](n)
+    return tuple(region_func(0, 0, n))
 
 
 def get_func_string(func):
@@ -98,7 +132,16 @@ def resize_intelligently(image, train_size):
     resize_factor = (float(train_size)/(curr_height*curr_width))**.5
     new_width = int(round(curr_width * resize_factor))
     new_height = int(round(curr_height * resize_factor))
-    image = image.resize((new_width, new_height))
+    if image.format == 'JPEG':
+        # JPEGs can be decoded at 1/2, 1/4 or 1/8 scale for a fraction of
+        # the work, and draft picks the smallest of those that's still at
+        # least the size we ask for (it does nothing if the image is already
+        # loaded). We ask for twice the new size so the resize below still
+        # has some detail to average over.
+        image.draft('RGB', (2 * new_width, 2 * new_height))
+    # reducing_gap shrinks by whole factors first, which is much faster
+    # than resampling all of a big image
+    image = image.resize((new_width, new_height), reducing_gap=3.0)
     return image
 
 def pixel_argmax(pixels, pixels_to_exclude, width, height):
@@ -113,7 +156,18 @@ def pixel_argmax(pixels, pixels_to_exclude, width, height):
     return (max_x, max_y)
 
 def show_im(image, width, height):
-    root = Tk()
+    # imported here so that nothing else needs a display
+    try:
+        from tkinter import Tk, Canvas, NW, TclError
+        from PIL import ImageTk
+    except ImportError:
+        print("tkinter isn't installed, so not showing the picture")
+        return
+    try:
+        root = Tk()
+    except TclError: # e.g. no $DISPLAY
+        print("Couldn't open a window, so not showing the picture")
+        return
     canvas = Canvas(root, width = width, height = height)
     canvas.pack()
     tk_gray = ImageTk.PhotoImage(image)
@@ -153,12 +207,33 @@ def get_input_paths(image_short_dir, filenames):
     return image_paths
 
 def make_output_name(shape_func, train_region_size, gen_region_size, 
-                     train_palette_size, palette_files, shape_strength):
-    palette_files_no_extn = [fname[:fname.find('.')] for fname in palette_files]
+                     train_palette_size, palette_files, shape_strength,
+                     seed=None, color_model='channels', mode='dfs'):
+    palette_files_no_extn = [os.path.splitext(fname)[0] for fname in palette_files]
     palette_files_string = '_'.join(palette_files_no_extn)
-    return ('output/%s_train_size=%d_gen_region_size=%d_shape_strength=%d_train_pal_size=%d_palette_files=%s.jpg' %
+    # seeded runs are reproducible, so the seed is part of the name
+    seed_string = '' if seed is None else '_seed=%d' % seed
+    # the default color model and mode aren't named, so old names stay the
+    # same
+    color_model_string = ('' if color_model == 'channels'
+                          else '_color_model=%s' % color_model)
+    mode_string = '' if mode == 'dfs' else '_mode=%s' % mode
+    return ('output/%s_train_size=%d_gen_region_size=%d_shape_strength=%d_train_pal_size=%d_palette_files=%s%s%s%s.jpg' %
             (get_func_string(shape_func), train_region_size, gen_region_size, 
-             shape_strength, train_palette_size, palette_files_string))
+             shape_strength, train_palette_size, palette_files_string,
+             seed_string, color_model_string, mode_string))
+
+def touching_mask(mask, width, height):
+    # mask is bytes with mask[y * width + x] == 1 for some set of pixels.
+    # Returns a (height, width) bool array of the pixels outside the set
+    # that are directly next to (up, down, left, right) a pixel in it.
+    inside = np.frombuffer(mask, dtype=np.uint8).reshape(height, width) == 1
+    touching = np.zeros_like(inside)
+    touching[1:, :] |= inside[:-1, :]
+    touching[:-1, :] |= inside[1:, :]
+    touching[:, 1:] |= inside[:, :-1]
+    touching[:, :-1] |= inside[:, 1:]
+    return touching & ~inside
 
 def get_all_pixels(width, height):
     result = []
@@ -0,0 +1,151 @@
+# wavefront.py - batched floodfill generation for main.py
+# Author: Ben Plaut
+# An alternative to the one-pixel-at-a-time depth first floodfill in
+# main.py. Every pixel on the edge of the filled region gets an arrival time:
+# when a pixel is filled at time t, each unfilled neighbor in direction d can
+# be reached at t + (random exponential) / wts[d], using the same shape wts
+# as the floodfill, so the fill races ahead in the directions the shape
+# favors and leaves the same kind of brushstrokes. Each step takes a batch
+# of the earliest edge pixels, no two of them next to each other, and
+# generates all of their colors at once with numpy.
+# Required external modules: numpy
+# Required python files: markov.py, util.py, random_permutation.py
+
+import numpy as np
+import markov
+import util
+from random_permutation import RandomPermutation
+
+# the 4 floodfill directions, in the same order as the shape wts
+DIRECTIONS = [(1, 0), (0, 1), (0, -1), (-1, 0)]
+
+def neighbors(pixels, dx, dy, width, height):
+    # flat indices of the neighbors at (dx, dy), and which ones are in bounds
+    # (out of bounds ones get index 0, so they're safe to index with)
+    xs = pixels % width + dx
+    ys = pixels // width + dy
+    valid = (0 <= xs) & (xs < width) & (0 <= ys) & (ys < height)
+    return (np.where(valid, ys * width + xs, 0), valid)
+
+def choose_batch(frontier, arrival, is_candidate, width, height,
+                 batch_fraction):
+    # The candidates are the batch_fraction of the frontier that arrive
+    # first. Of those, take the ones that arrive before all of their
+    # neighboring candidates, which guarantees no two chosen pixels touch.
+    times = arrival[frontier]
+    if len(frontier) > 1:
+        k = int(batch_fraction * (len(frontier) - 1))
+        cutoff = np.partition(times, k)[k]
+        candidates = frontier[times <= cutoff]
+    else:
+        candidates = frontier
+    is_candidate[candidates] = True
+    own_times = arrival[candidates]
+    chosen = np.ones(len(candidates), dtype=bool)
+    for (dx, dy) in DIRECTIONS:
+        (adj, valid) = neighbors(candidates, dx, dy, width, height)
+        competing = valid & is_candidate[adj]
+        adj_times = np.where(competing, arrival[adj], np.inf)
+        # ties are broken by pixel index
+        chosen &= ((own_times < adj_times) |
+                   ((own_times == adj_times) & (candidates < adj)))
+    is_candidate[candidates] = False
+    return candidates[chosen]
+
+def batch_colors(batch, result, filled, region, table, rng, width, height):
+    # Same as Model.generate_one_pixel for every pixel in batch at once: each
+    # filled neighbor in the region predicts a color, and we average them.
+    # All (pixel, neighbor) pairs are sampled together; table is the three
+    # channel tables in one markov.batch_table.
+    (dx, dy) = np.array(region).T[:, :, np.newaxis]
+    xs = batch % width + dx
+    ys = batch // width + dy
+    valid = (0 <= xs) & (xs < width) & (0 <= ys) & (ys < height)
+    adj = np.where(valid, ys * width + xs, 0)
+    valid &= filled[adj]
+    owner = np.broadcast_to(np.arange(len(batch)), adj.shape)[valid]
+    prev = result[adj[valid]].astype(np.intp)
+    prev += np.arange(3) * markov.NUM_VALS # each channel's rows in table
+    sampled = markov.sample_rows_batch(table, prev, rng.random(prev.shape))
+    count = np.bincount(owner, minlength=len(batch))
+    colors = np.empty((len(batch), 3))
+    for channel in range(3):
+        colors[:, channel] = np.bincount(owner, weights=sampled[:, channel],
+                                         minlength=len(batch))
+    return np.rint(colors / count[:, np.newaxis]).astype(np.uint8)
+
+def spread(batch, arrival, filled, in_frontier, wts, rng, width, height):
+    # Give the unfilled neighbors of the newly filled batch their arrival
+    # times, and return the ones that are new to the frontier
+    new = []
+    for (direction, (dx, dy)) in enumerate(DIRECTIONS):
+        (adj, valid) = neighbors(batch, dx, dy, width, height)
+        valid &= ~filled[adj]
+        (src, adj) = (batch[valid], adj[valid])
+        times = (arrival[src] + rng.standard_exponential(len(src))
+                 / wts[src, direction])
+        np.minimum.at(arrival, adj, times)
+        fresh = adj[~in_frontier[adj]]
+        in_frontier[fresh] = True
+        new.append(fresh)
+    return np.concatenate(new)
+
+def generate_wavefront(model, batch_fraction = 0.25):
+    # model must already be trained. Returns the picture as an Image, and
+    # sets the same stats on the model as Model.generate.
+    (width, height) = (model.width, model.height)
+    num_pixels = width * height
+    if model.wts_field is None:
+        model.load_shape_field()
+    model.new_result_buffer()
+    result = model.result_array.reshape(num_pixels, 3)
+    wts = model.wts_field.reshape(num_pixels, 4)
+    table = markov.batch_table([row for channel_table in model.tables
+                                for row in channel_table])
+    region = util.region_offsets(util.surrounding_region,
+                                 model.gen_region_size)
+    # numpy's generator for the array draws, seeded from the model's
+    rng = np.random.default_rng(model.rng.seed_int())
+
+    filled = np.zeros(num_pixels, dtype=bool)
+    in_frontier = np.zeros(num_pixels, dtype=bool)
+    is_candidate = np.zeros(num_pixels, dtype=bool)
+    arrival = np.full(num_pixels, np.inf)
+    frontier = np.zeros(0, dtype=np.intp)
+    # new fills start from the first unfilled pixel in a scrambled order,
+    # which is worked out as we go instead of stored
+    seed_order = RandomPermutation(num_pixels, model.rng.seed_int())
+    seed_cursor = 0
+    (model.num_seen, model.num_known, model.num_seeds) = (0, 0, 0)
+    model.start_capture()
+    now = 0.0
+    progress_step = max(num_pixels // 10, 1)
+    while model.num_seen < model.gen_pixel_limit:
+        if len(frontier) == 0:
+            (seed, seed_cursor) = seed_order.next_unmarked(seed_cursor, filled)
+            batch = np.array([seed], dtype=np.intp)
+            # no neighbors to predict from, so pick trained values at random
+            result[batch[0]] = [vals[rng.integers(len(vals))]
+                                for vals in model.trained_vals]
+            arrival[batch] = now
+            model.num_seeds += 1
+        else:
+            batch = choose_batch(frontier, arrival, is_candidate, width,
+                                 height, batch_fraction)
+            batch = batch[:model.gen_pixel_limit - model.num_seen]
+            result[batch] = batch_colors(batch, result, filled, region,
+                                         table, rng, width, height)
+        filled[batch] = True
+        if model.capture_order is not None:
+            model.capture_order.frombytes(batch.astype(np.uint32).tobytes())
+        in_frontier[batch] = False
+        now = max(now, arrival[batch].max())
+        new = spread(batch, arrival, filled, in_frontier, wts, rng, width,
+                     height)
+        frontier = np.concatenate([frontier[in_frontier[frontier]], new])
+        old_progress = model.num_seen // progress_step
+        model.num_seen += len(batch)
+        if model.show_progress and model.num_seen // progress_step > old_progress:
+            print("%d%% done" % (100 * model.num_seen // num_pixels))
+    model.save_capture()
+    return model.result_to_image()